@@ -3,6 +3,11 @@
 import sublime, sublime_plugin
 import re, string, os
 
+try:
+    from . import vhdl_util
+except (ImportError, ValueError):
+    import vhdl_util
+
 #filename can be in a unix specific format => convert to windows if needed
 def normalize_fname(fname):
     if sublime.platform() == 'windows':
@@ -82,8 +87,7 @@ def lookup_symbol(view, name, re_str):
         if not info['match'] :
             for i,f in enumerate(flist):
                 info['fname'] = flist_norm[i]
-                with open(info['fname']) as file:
-                    flines = file.read()
+                flines = vhdl_util.read_file(info['fname'])
                 info['match'] = re.search(re_str,flines,flags=re.MULTILINE)
                 # Stop when match succeed
                 if info['match']:
@@ -1,7 +1,7 @@
 # Class/function to process verilog file
 import re, string, os
 import pprint
-import functools
+import functools, collections, threading, bisect
 
 # regular expression for signal/variable declaration:
 s_id_list = r'\w+\b([\s\w,]+)?'
@@ -19,63 +19,238 @@ re_alias_ref = r'(?i)^\s*(?P<tag>alias)\s+(?P<name>\w+)\s+is\s+<<(?P<value>.*?)>
 
 ###############################################################################
 # Clean all comment (useful before parsing file for information)
-def clean_comment(text):
+# Comments (and optionnaly strings) are replaced by spaces, keeping line returns:
+# length and offsets are preserved so that a match position is the same as in the original text
+re_comment = re.compile(r'--.*?$|/\*.*?\*/|"(?:\\.|[^\\"])*"', re.DOTALL | re.MULTILINE)
+
+def clean_comment(text, mask_string=False):
     def replacer(match):
         s = match.group(0)
-        if s.startswith('"'):
+        if s.startswith('"') and not mask_string:
             return s
         else:
-            return " " # note: a space and not an empty string
+            return blank(s)
+    return re_comment.sub(replacer, text)
+
+# Replace all characters by space except line return
+def blank(s):
+    if '\n' not in s:
+        return ' '*len(s)
+    return re.sub(r'[^\n]+', lambda m: ' '*len(m.group(0)), s)
 
-    pattern = re.compile(
-        r'--.*?$|/\*.*?\*/|"(?:\\.|[^\\"])*"',
-        re.DOTALL | re.MULTILINE
-    )
-    return re.sub(pattern, replacer, text)
+# Table of the offset of the start of each line, to convert a position in row/col
+@functools.lru_cache(maxsize=8)
+def get_line_table(txt):
+    return [0] + [m.end() for m in re.finditer(r'\n',txt)]
+
+# Convert a position in a text to (row,col) (starting at 0, like view.rowcol)
+def get_rowcol(line_table, pos):
+    row = bisect.bisect_right(line_table, pos) - 1
+    return row, pos - line_table[row]
+
+###############################################################################
+# Shared file content cache: raw and comment-stripped text of files keyed by
+# path and mtime. Least recently used files are evicted when the total size
+# exceeds the byte budget.
+file_cache = collections.OrderedDict()
+file_cache_info = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'budget': 32*1024*1024}
+file_cache_lock = threading.Lock()
+
+def set_file_cache_budget(budget):
+    with file_cache_lock:
+        file_cache_info['budget'] = budget
+        file_cache_evict()
+
+def get_file_cache_info():
+    with file_cache_lock:
+        info = dict(file_cache_info)
+        info['files'] = len(file_cache)
+    return info
+
+# Must be called with the lock acquired
+def file_cache_evict():
+    while file_cache and file_cache_info['size'] > file_cache_info['budget']:
+        _,e = file_cache.popitem(last=False)
+        file_cache_info['size'] -= e['size']
+        file_cache_info['evictions'] += 1
+
+# Return the content of a file, optionnaly without comments (cf clean_comment)
+# Raise OSError if the file cannot be read
+def read_file(fname, clean=False):
+    mtime = os.path.getmtime(fname)
+    with file_cache_lock:
+        e = file_cache.get(fname)
+        if e and e['mtime'] == mtime:
+            file_cache.move_to_end(fname)
+            file_cache_info['hits'] += 1
+        else:
+            e = None
+            file_cache_info['misses'] += 1
+    if not e:
+        with open(fname) as f:
+            e = {'mtime': mtime, 'txt': f.read(), 'clean': None}
+        e['size'] = len(e['txt'])
+        with file_cache_lock:
+            if fname in file_cache:
+                file_cache_info['size'] -= file_cache.pop(fname)['size']
+            file_cache[fname] = e
+            file_cache_info['size'] += e['size']
+            file_cache_evict()
+    if not clean:
+        return e['txt']
+    if e['clean'] is None:
+        e['clean'] = clean_comment(e['txt'])
+        with file_cache_lock:
+            if file_cache.get(fname) is e:
+                e['size'] += len(e['clean'])
+                file_cache_info['size'] += len(e['clean'])
+                file_cache_evict()
+    return e['clean']
 
 ###############################################################################
 # Extract declaration of var_name from a file
 def get_type_info_file(fname,var_name, flag):
     # print("Parsing file " + fname + " for variable " + var_name)
-    fdate = os.path.getmtime(fname)
-    ti = get_type_info_file_cache(fname, var_name, fdate, flag)
-    # print(get_type_info_file_cache.cache_info())
-    return ti
-
-@functools.lru_cache(maxsize=32)
-def get_type_info_file_cache(fname, var_name, fdate, flag):
-    with open(fname) as f:
-        flines = f.read()
-        ti = get_type_info(flines, var_name, flag)
-    return ti
+    index = get_decl_index_file(fname)
+    return get_type_info_from_index(index, var_name, flag)
 
 # Extract the declaration of var_name from txt
 #return a dictionnary with full information
 def get_type_info(txt,var_name, flag):
-    txt = clean_comment(txt)
-    txt = re.sub(r'(?si)^[ \t]*component\b.*?\bend\b.*?;','',txt) # remove component declaration
-    re_list = []
-    if flag & 1:
-        re_list += [re_entity]
-    if flag & 2:
-        re_list += [re_architecture]
-    if flag & 4:
-        re_list += [re_signal, re_port, re_const, re_generic, re_record, re_alias, re_alias_ref]
-    m = None
-    for s in re_list:
-        if '<tag>type' in s:
-            re_s = s.replace(s_id_list,r'\s*{}\s*'.format(var_name),1)
-        elif '<type>entity' in s or '<type>architecture' in s or '<tag>alias' in s:
-            re_s = s.replace(r'<name>\w+','<name>' + var_name,1)
-        else :
-            re_s = s.replace(s_id_list,r'(?:,?\s*)\b' + var_name + r'\b(?:[\s\w,]+)?',1)
-        # print(re_s)
-        m = re.search(re_s, txt, flags=re.MULTILINE)
-        if m:
-            # print(m.groups())
-            break
-    ti = get_type_info_from_match(var_name,m)[0]
-    return ti
+    index = get_decl_index(txt)
+    return get_type_info_from_index(index, var_name, flag)
+
+# Lookup var_name in a declaration index
+# The kind priority follows decl_kinds order, and only kinds enabled by flag are checked
+def get_type_info_from_index(index, var_name, flag):
+    key = var_name.lower()
+    for kind,_,kind_flag in decl_kinds:
+        if flag & kind_flag and key in index[kind]:
+            return dict(index[kind][key])
+    return {'decl':None, 'type':None, 'name':var_name, 'tag':'', 'value':None}
+
+###############################################################################
+# Declaration index: all declarations of a text in a table keyed by kind then
+# by lower-case name (VHDL is case insensitive). Only the first declaration of
+# each name is kept for a given kind.
+
+# Entity/architecture header (the body is not needed to build the declaration)
+re_entity_head = r'(?si)^\s*(?P<type>entity)\s+(?P<name>\w+)\s+is\s+\b'
+re_architecture_head = r'(?si)^\s*(?P<type>architecture)\s+(?P<tag>\w+)\s+of\s+(?P<name>\w+)\s+is\s+\b'
+
+# Declaration kinds in lookup priority order: (kind, regex, flag)
+decl_kinds = [
+    ('entity'      , re_entity_head      , 1),
+    ('architecture', re_architecture_head, 2),
+    ('signal'      , re_signal           , 4),
+    ('port'        , re_port             , 4),
+    ('const'       , re_const            , 4),
+    ('generic'     , re_generic          , 4),
+    ('record'      , re_record           , 4),
+    ('alias'       , re_alias            , 4),
+    ('alias_ref'   , re_alias_ref        , 4),
+]
+
+def get_decl_index_file(fname):
+    fdate = os.path.getmtime(fname)
+    index = get_decl_index_file_cache(fname, fdate)
+    # print(get_decl_index_file_cache.cache_info())
+    return index
+
+@functools.lru_cache(maxsize=32)
+def get_decl_index_file_cache(fname, fdate):
+    return build_decl_index(read_file(fname,True))
+
+# Index is cached on the text content: it is rebuilt only when the content changes
+def get_decl_index(txt):
+    index = get_decl_index_cache(txt)
+    # print(get_decl_index_cache.cache_info())
+    return index
+
+@functools.lru_cache(maxsize=8)
+def get_decl_index_cache(txt):
+    return build_decl_index(clean_comment(txt))
+
+# Build the declaration index from a text without comments
+# Each entry also contains the position of the declared name in the text ('pos')
+def build_decl_index(txt):
+    txt = re.sub(r'(?si)^[ \t]*component\b.*?\bend\b.*?;',lambda m: blank(m.group(0)),txt) # remove component declaration
+    index = {}
+    for kind,re_s,_ in decl_kinds:
+        d = {}
+        p = re.compile(re_s, flags=re.MULTILINE)
+        m = p.search(txt)
+        while m:
+            # Restart on the next line: matches can overlap (e.g. a record content or a multi-line type)
+            pos = m.start('name') + 1
+            if kind in ['entity','architecture']:
+                ti_l = get_type_info_from_match(m.group('name'),m)
+            # Skip list containing space separated words (e.g. "signal x" matched as a generic)
+            elif re.search(r'\w\s+\w',m.group('name')):
+                ti_l = []
+            else:
+                ti_l = get_type_info_from_match('',m)
+            for ti in ti_l:
+                k = ti['name'].lower()
+                if k not in d:
+                    mn = re.search(r'\b{}\b'.format(ti['name']),m.group('name'))
+                    ti['pos'] = m.start('name') + (mn.start() if mn else 0)
+                    d[k] = ti
+            m = p.search(txt, pos)
+        index[kind] = d
+    return index
+
+# Chunked declaration index: the text is split at statement boundaries so that
+# the index of a modified text can be rebuilt by parsing only the modified chunks.
+# A chunk is never cut inside a record or a component declaration.
+re_chunk_token = re.compile(r'(?im)(?P<close>\bend\s+(?:component|record)\b)|(?P<open>^[ \t]*component\b|\bis\s+record\b)|(?P<unit>^[ \t]*(?:entity|architecture|package|configuration|context)\b)|(?P<eos>;[ \t]*$)')
+
+# Split a text without comments in a list of (offset, chunk)
+def split_decl_chunks(txt, chunk_size=8192):
+    chunks = []
+    start = 0
+    depth = 0
+    for m in re_chunk_token.finditer(txt):
+        if m.group('close'):
+            depth = max(depth-1,0)
+        elif m.group('open'):
+            depth += 1
+        elif m.group('unit'):
+            # Always start a new chunk on a design unit
+            depth = 0
+            if m.start() > start:
+                chunks.append((start,txt[start:m.start()]))
+                start = m.start()
+        elif depth==0 and m.end()-start >= chunk_size:
+            end = m.end()+1 if m.end() < len(txt) else m.end()
+            chunks.append((start,txt[start:end]))
+            start = end
+    if start < len(txt):
+        chunks.append((start,txt[start:]))
+    return chunks
+
+# Build the declaration index of a text without comments, reusing the index of
+# the chunks unchanged since the previous call.
+# chunks is the chunk cache returned by the previous call (chunk text -> index)
+# Return (index, chunk cache)
+def update_decl_index(txt, chunks=None):
+    index = {kind:{} for kind,_,_ in decl_kinds}
+    new_chunks = {}
+    for offset,c in split_decl_chunks(txt):
+        ci = new_chunks.get(c)
+        if ci is None:
+            ci = chunks.get(c) if chunks else None
+            if ci is None:
+                ci = build_decl_index(c)
+            new_chunks[c] = ci
+        for kind,d in ci.items():
+            dst = index[kind]
+            for k,ti in d.items():
+                if k not in dst:
+                    ti = dict(ti)
+                    ti['pos'] += offset
+                    dst[k] = ti
+    return index, new_chunks
 
 # Extract all signal declaration
 def get_all_type_info_from_record(decl):
@@ -129,7 +304,7 @@ def get_type_info_from_match(var_name,m):
     else:
         sig_l = [var_name]
     for sig in sig_l:
-        ti.append(d)
+        ti.append(dict(d))
         s = sig.strip()
         # Remove other signal from the declaration
         ti[-1]['decl'] = m.group(0).strip().replace(m.group('name'),s,1)
@@ -158,23 +333,28 @@ def get_inst_list_from_file(fname,mname=r'\w+'):
 
 @functools.lru_cache(maxsize=32)
 def get_inst_list_from_file_cache(fname, mname, fdate):
-    with open(fname) as f:
-        flines = f.read()
-        inst_l = get_inst_list(flines, mname)
+    inst_l = get_inst_list(read_file(fname,True), mname, True)
     #if inst_l is None : print('[get_inst_list] No architecture for {} in {}'.format(mname,fname))
     return inst_l
 
 # Retrieve the list of instances inside a block
-def get_inst_list(txt,name):
-    txt = clean_comment(txt)
+def get_inst_list(txt,name, cleaned=False):
+    if not cleaned:
+        txt = clean_comment(txt)
     # Remove function/procedure to avoid the end;
-    txt = re.sub(r'(?si)(function|procedure)\s+(\w+).*?\bend(?:\s+\1\b|\s+\2\b|\s*;)','',txt)
-    re_str = r'(?si)^\s*architecture\s+(\w+)\s+of\s+'+name+r'\s+is.*?end(?:\s+architecture\b|\s+\1\b|\s*;)'
-    m = re.search(re_str,txt,flags=re.MULTILINE)
+    txt = re.sub(re_subprogram_body,'',txt)
+    m = re.search(re_arch_body.format(name),txt,flags=re.MULTILINE)
     if not m:
         return None
-    l = re.findall(r'(?si)^\s*(\w+)\s*:\s*entity\s+(?:\w+\.)?(\w+)\b',m.group(0),flags=re.MULTILINE)
-    l += re.findall(r'(?si)^\s*(\w+)\s*:\s*(?:\w+\.)?(\w+)\s+(?:generic|port)\s+map\b',m.group(0),flags=re.MULTILINE)
+    return get_inst_list_from_arch(m.group(0))
+
+re_subprogram_body = r'(?si)(function|procedure)\s+(\w+).*?\bend(?:\s+\1\b|\s+\2\b|\s*;)'
+re_arch_body = r'(?si)^\s*architecture\s+(\w+)\s+of\s+(?P<name>{})\s+is.*?end(?:\s+architecture\b|\s+\1\b|\s*;)'
+
+# Retrieve the list of instances (label, entity/component) from an architecture content
+def get_inst_list_from_arch(txt):
+    l = re.findall(r'(?si)^\s*(\w+)\s*:\s*entity\s+(?:\w+\.)?(\w+)\b',txt,flags=re.MULTILINE)
+    l += re.findall(r'(?si)^\s*(\w+)\s*:\s*(?:\w+\.)?(\w+)\s+(?:generic|port)\s+map\b',txt,flags=re.MULTILINE)
     return l
 
 
@@ -189,16 +369,20 @@ def get_ports_file(fname,mname=r'\w+'):
 
 @functools.lru_cache(maxsize=32)
 def get_ports_file_cache(fname, mname, fdate):
-    with open(fname) as f:
-        flines = f.read()
-        minfo = get_ports(flines, mname)
+    minfo = get_ports(read_file(fname,True), mname, True)
     return minfo
 
-def get_ports(flines,mname=r'\w+'):
-    flines = clean_comment(flines)
-    m = re.search(r"(?si)(?P<type>entity|component)\s+(?P<name>"+mname+r")\s+is\s+(generic\s*\((?P<generic>.*?)\)\s*;\s*)?(port\s*\((?P<port>.*?)\)\s*;)?\s*(?P<ending>end\b.*?);", flines, re.MULTILINE)
+def get_ports(flines,mname=r'\w+', cleaned=False):
+    if not cleaned:
+        flines = clean_comment(flines)
+    m = re.search(re_ports_decl.format(mname), flines, re.MULTILINE)
     if m is None:
         return None
+    return get_ports_from_match(m)
+
+re_ports_decl = r"(?si)(?P<type>entity|component)\s+(?P<name>{})\s+is\s+(generic\s*\((?P<generic>.*?)\)\s*;\s*)?(port\s*\((?P<port>.*?)\)\s*;)?\s*(?P<ending>end\b.*?);"
+
+def get_ports_from_match(m):
     info = {'param': [], 'port': [], 'name':m.group('name'), 'type':m.group('type')}
     # print('Generics = {}\nPorts={}'.format(m.group('generic'),m.group('port')))
     if m.group('generic'):
@@ -209,12 +393,329 @@ def get_ports(flines,mname=r'\w+'):
             info['port'] += get_type_info_from_match('',mp)
     return info
 
+###############################################################################
+# Summary of a file: design units declared (with the line of each entity/component
+# declaration in decl_line) with ports & generics of each entity/component, instances of each architecture, symbols declared (cf get_symbols),
+# members of packages (cf get_package_decl) and signatures of subprograms (cf get_signatures).
+# Used to build the project index.
+def get_file_info(txt):
+    info = {'entity': [], 'component': [], 'architecture': [], 'package': [], 'ports': {}}
+    # Keep track of files referencing entity/component (candidate for module instantiation)
+    info['module'] = 'entity' in txt or 'component' in txt
+    info['inst'] = get_inst_sites(txt)
+    txt = clean_comment(txt)
+    lt = get_line_table(txt)
+    info['decl_line'] = {}
+    for m in re.finditer(r'(?i)^\s*(entity|component)\s+(\w+)\s+is\b', txt, flags=re.MULTILINE):
+        info[m.group(1).lower()].append(m.group(2))
+        k = m.group(2).lower()
+        if k not in info['decl_line'] or m.group(1).lower() == 'entity':
+            info['decl_line'][k] = get_rowcol(lt, m.start(2))[0] + 1
+    for m in re.finditer(re_ports_decl.format(r'\w+'), txt, flags=re.MULTILINE):
+        if m.group('name') not in info['ports']:
+            info['ports'][m.group('name')] = get_ports_from_match(m)
+    # Architecture with the list of instances
+    txt_arch = re.sub(re_subprogram_body,'',txt)
+    for m in re.finditer(re_arch_body.format(r'\w+'), txt_arch, flags=re.MULTILINE):
+        info['architecture'].append([m.group(1),m.group('name'),get_inst_list_from_arch(m.group(0))])
+    for m in re.finditer(r'(?i)^\s*package\s+(\w+)\s+is\b', txt, flags=re.MULTILINE):
+        info['package'].append(m.group(1))
+    info['symbols'] = get_symbols(txt)
+    info['package_decl'] = get_package_decl(txt)
+    info['subprograms'] = get_signatures(get_outline(txt))
+    for sig in info['subprograms']:
+        sig['line'] = get_rowcol(lt, sig.pop('pos'))[0] + 1
+    return info
+
+# Symbols declared in a text without comments, used for identifier completion:
+# list of [name, kind, detail] with kind in entity, component, package, type,
+# enum, constant, function, procedure. Only the first declaration of a name is kept for each kind.
+re_symbol = re.compile('|'.join([
+    r'^[ \t]*(?P<unit>entity|component|package)\s+(?!body\b)(?P<uname>\w+)\s+is\b',
+    r'^[ \t]*(?P<type>type|subtype)\s+(?P<tname>\w+)\s+is\s+(?P<tdef>\([^)]*\)|[\w.]+)',
+    r'^[ \t]*constant\s+(?P<cname>\w+(?:\s*,\s*\w+)*)\s*:\s*(?P<ctype>[\w.]+)',
+    r'\b(?P<sub>function|procedure)\s+(?P<sname>\w+)',
+]), flags=re.IGNORECASE | re.MULTILINE)
+
+def get_symbols(txt):
+    l = []
+    seen = set()
+    def add(name, kind, detail):
+        k = (name.lower(), kind)
+        if k not in seen:
+            seen.add(k)
+            l.append([name, kind, detail])
+    for m in re_symbol.finditer(txt):
+        if m.group('unit'):
+            add(m.group('uname'), m.group('unit').lower(), '')
+        elif m.group('type'):
+            tdef = m.group('tdef')
+            if tdef.startswith('('):
+                add(m.group('tname'), 'type', 'enum')
+                for e in re.findall(r'\b[A-Za-z]\w*\b', tdef):
+                    add(e, 'enum', m.group('tname'))
+            else:
+                add(m.group('tname'), m.group('type').lower(), tdef)
+        elif m.group('cname'):
+            for n in re.split(r'\s*,\s*', m.group('cname')):
+                add(n, 'constant', m.group('ctype'))
+        else:
+            add(m.group('sname'), m.group('sub').lower(), '')
+    return l
+
+# Retrieve all instantiations of a text: list of [label, entity/component name, library, line]
+re_inst_site = r'(?si)^\s*(?P<label>\w+)\s*:\s*(?:use\s+)?(?:entity\s+)?(?:(?P<lib>\w+)\.)?(?P<name>\w+)(\s*\(\s*\w+\s*\))?\s+(port|generic)\b'
+
+def get_inst_sites(txt):
+    l = []
+    txt = clean_comment(txt, True)
+    lt = get_line_table(txt)
+    for m in re.finditer(re_inst_site, txt, flags=re.MULTILINE):
+        row,_ = get_rowcol(lt, m.start('label'))
+        l.append([m.group('label'), m.group('name'), m.group('lib') or '', row+1])
+    return l
+
+###############################################################################
+# Packages declared in a text without comments: {package name (lower case): {name, spec, body, decl}}
+#  - spec/body: True if the package declaration/body is in the text
+#  - decl: members of the package (cf get_symbols) as {name (lower case): kind}
+re_unit_start = re.compile(r'(?im)^[ \t]*(?:(?P<pkg>package)\s+(?P<body>body\s+)?(?P<name>\w+)\s+is\b|(?:entity|architecture|configuration|context)\b)')
+
+def get_package_decl(txt):
+    d = {}
+    ml = list(re_unit_start.finditer(txt))
+    for i,m in enumerate(ml):
+        if not m.group('pkg'):
+            continue
+        end = ml[i+1].start() if i+1 < len(ml) else len(txt)
+        p = d.setdefault(m.group('name').lower(), {'name': m.group('name'), 'spec': False, 'body': False, 'decl': {}})
+        p['body' if m.group('body') else 'spec'] = True
+        for name,kind,_ in get_symbols(txt[m.end():end]):
+            p['decl'].setdefault(name.lower(), kind)
+    return d
+
+# Use clauses of a text without comments: list of [library, package, item] in lower case
+# (item is 'all' for use lib.pkg.all). A package body also sees the declaration of its package.
+re_use = re.compile(r'(?i)\buse\s+([\w.\s,]+?);')
+
+def get_use_clauses(txt):
+    l = []
+    for m in re_use.finditer(txt):
+        for x in m.group(1).split(','):
+            n = [y.strip().lower() for y in x.split('.')]
+            if len(n) == 3 and all(n):
+                l.append(n)
+    for m in re.finditer(r'(?im)^[ \t]*package\s+body\s+(\w+)', txt):
+        l.append(['work', m.group(1).lower(), 'all'])
+    return l
+
+def get_use_clauses_file(fname):
+    fdate = os.path.getmtime(fname)
+    return get_use_clauses_file_cache(fname, fdate)
+
+@functools.lru_cache(maxsize=32)
+def get_use_clauses_file_cache(fname, fdate):
+    return get_use_clauses(read_file(fname,True))
+
+###############################################################################
+# Subprogram signatures: overloaded functions/procedures are identified by their
+# name and parameter profile (base type of each argument) plus the return type.
+
+# Base type of an argument: no default value, no constraint, lower case
+def arg_base_type(t):
+    t = t.split(':=')[0].split('(')[0]
+    t = re.sub(r'(?i)\s+range\b.*','',t)
+    return re.sub(r'\s+',' ',t).strip().lower()
+
+# Key of a subprogram signature, e.g. "to_slv(integer,natural) return std_logic_vector"
+def subprogram_key(name, args, ret=None):
+    key = '{}({})'.format(name.lower(), ','.join([arg_base_type(a['type']) for a in args]))
+    if ret:
+        key += ' return ' + ret.lower()
+    return key
+
+# Signatures of all subprograms of an outline: list of {name, kind, key, args, return, pos}
+# with args a list of [name, direction, type]
+def get_signatures(outline):
+    l = []
+    for t,kind in [('func','function'),('proc','procedure')]:
+        for key,v in outline[t].items():
+            args = [[a['name'], a.get('dir') or '', re.sub(r'\s+',' ',a['type']).strip()] for a in v['args']]
+            l.append({'name': v['name'], 'kind': kind, 'key': key, 'args': args, 'return': v.get('return'), 'pos': v['pos']})
+    return l
+
+# Declaration of a signature as a string
+def format_signature(sig):
+    s = '{} {}'.format(sig['kind'], sig['name'])
+    if sig['args']:
+        s += '(' + '; '.join(['{} : {}{}'.format(a[0], a[1]+' ' if a[1] else '', a[2]) for a in sig['args']]) + ')'
+    if sig['return']:
+        s += ' return ' + sig['return']
+    return s
+
+###############################################################################
+# Outline of a file: all the information displayed by the navigation bar, extracted
+# in a single scan of the text (without comments):
+#  - entity      : {name: {name, generic, port}}
+#  - architecture: {entity name: {name, arch, signal, const, alias, inst}} (first architecture only)
+#  - package     : {name: {name, signal, const, alias}}
+#  - func/proc   : {signature key: {name, args, return, pos}} in declaration order (cf subprogram_key)
+#  - process     : list of process labels
+# Keys of the tables are lower-case (VHDL is case insensitive).
+re_outline = re.compile('|'.join([
+    r'\bend\s+(?:function|procedure|component)\b',
+    r'^[ \t]*(?P<unit>entity|package\s+body|package)\s+(?P<uname>\w+)\s+is\b',
+    r'^[ \t]*architecture\s+(?P<arch>\w+)\s+of\s+(?P<aname>\w+)\s+is\b',
+    r'^[ \t]*(?P<comp>component)\b',
+    r'\b(?P<clause>generic|port)\s*\(',
+    r'\b(?P<sub>function|procedure)\s+(?P<sname>\w+)\s*',
+    r'^[ \t]*(?P<decl>signal|constant|alias)\b[^;]*;',
+    r'^[ \t]*(?P<label>\w+)\s*:\s*(?:(?P<process>(?:postponed\s+)?process)\b|entity\s+(?:\w+\.)?(?P<ient>\w+)|(?:component\s+)?(?:\w+\.)?(?P<icomp>\w+)\s+(?:generic|port)\s+map\b)',
+    r'\b(?P<begin>begin)\b',
+]), flags=re.IGNORECASE | re.MULTILINE)
+re_outline_sub_tail = re.compile(r'(?si)\s*(?:return\s+(?P<ret>[\w.]+)\s*)?(?P<term>\bis\b|;)')
+re_outline_comp_end = re.compile(r'(?si)\bend\s+component\b[^;]*;')
+re_paren = re.compile(r'[()]')
+
+# Return the position of the parenthesis closing the one at pos (-1 if not found)
+def find_closing_paren(txt, pos):
+    depth = 0
+    for m in re_paren.finditer(txt, pos):
+        if m.group(0) == '(':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return m.start()
+    return -1
+
+# Outline is cached on the text content: it is extracted only once per version of a file
+@functools.lru_cache(maxsize=8)
+def get_outline(txt):
+    outline = {'entity': {}, 'architecture': {}, 'package': {}, 'func': collections.OrderedDict(), 'proc': collections.OrderedDict(), 'process': []}
+    unit = ''
+    cur = None
+    in_body = False
+    pos = 0
+    m = re_outline.search(txt)
+    while m:
+        pos = m.end()
+        if m.group('unit'):
+            unit = m.group('unit').lower().split()[-1]
+            in_body = False
+            if unit == 'entity':
+                cur = {'name': m.group('uname'), 'generic': [], 'port': []}
+            elif unit == 'package':
+                cur = {'name': m.group('uname'), 'signal': [], 'const': [], 'alias': []}
+            else :
+                cur = None
+            if cur :
+                cur = outline[unit].setdefault(m.group('uname').lower(), cur)
+        elif m.group('arch'):
+            unit = 'architecture'
+            in_body = False
+            cur = {'name': m.group('aname'), 'arch': m.group('arch'), 'signal': [], 'const': [], 'alias': [], 'inst': []}
+            cur = outline[unit].setdefault(m.group('aname').lower(), cur)
+        elif m.group('comp'):
+            # Skip component declaration
+            me = re_outline_comp_end.search(txt, pos)
+            if me:
+                pos = me.end()
+        elif m.group('clause'):
+            end = find_closing_paren(txt, m.end()-1)
+            if end > 0:
+                if unit == 'entity' and cur and not cur[m.group('clause').lower()]:
+                    content = txt[m.end():end] + ';'
+                    if m.group('clause').lower() == 'generic':
+                        cur['generic'] = [ti for mp in re.finditer(re_generic, content, flags=re.MULTILINE) for ti in get_type_info_from_match('',mp)]
+                    else :
+                        cur['port'] = [ti for mp in re.finditer(re_port, content, flags=re.MULTILINE) for ti in get_type_info_from_match('',mp)]
+                pos = end + 1
+        elif m.group('sub'):
+            args = ''
+            if txt[pos:pos+1] == '(':
+                end = find_closing_paren(txt, pos)
+                if end > 0:
+                    args = txt[pos+1:end]
+                    pos = end + 1
+            mt = re_outline_sub_tail.match(txt, pos)
+            if mt:
+                pos = mt.end()
+                t = 'func' if m.group('sub').lower() == 'function' else 'proc'
+                name = m.group('sname')
+                arg_l = [ti for ma in re.finditer(re_args, args+';', flags=re.MULTILINE) for ti in get_type_info_from_match('',ma)]
+                ret = mt.group('ret') if t == 'func' else None
+                key = subprogram_key(name, arg_l, ret)
+                # Declaration and body share the same signature: keep only the first one
+                if key not in outline[t]:
+                    info = {'name': name, 'args': arg_l, 'pos': m.start('sname')}
+                    if t == 'func':
+                        info['return'] = ret
+                    outline[t][key] = info
+                # Skip subprogram body
+                if mt.group('term').lower() == 'is':
+                    re_end = r'(?si)\bend(?:\s+{}\b|\s+{}\b|\s*;)'.format(m.group('sub'),name)
+                    me = re.compile(re_end).search(txt, pos)
+                    if me:
+                        pos = me.end()
+        elif m.group('decl'):
+            if cur is not None and not in_body and unit in ['architecture','package']:
+                stmt = m.group(0)
+                d = m.group('decl').lower()
+                if d == 'signal':
+                    ms = re.match(re_signal, stmt, flags=re.MULTILINE)
+                    k = 'signal'
+                elif d == 'constant':
+                    ms = re.match(re_const, stmt, flags=re.MULTILINE)
+                    k = 'const'
+                else:
+                    ms = re.match(re_alias, stmt, flags=re.MULTILINE) or re.match(re_alias_ref, stmt, flags=re.MULTILINE)
+                    k = 'alias'
+                if ms:
+                    cur[k] += get_type_info_from_match('',ms)
+        elif m.group('label'):
+            if m.group('process'):
+                outline['process'].append(m.group('label'))
+            elif unit == 'architecture' and in_body:
+                cur['inst'].append((m.group('label'), m.group('ient') or m.group('icomp')))
+        elif m.group('begin'):
+            if unit == 'architecture':
+                in_body = True
+        m = re_outline.search(txt, pos)
+    return outline
+
+def get_outline_file(fname):
+    fdate = os.path.getmtime(fname)
+    return get_outline_file_cache(fname, fdate)
+
+@functools.lru_cache(maxsize=32)
+def get_outline_file_cache(fname, fdate):
+    return get_outline(read_file(fname,True))
+
+# Information of a module (entity/architecture or package) from the outline of a file
+def get_outline_module(outline, t, name):
+    k = name.lower()
+    info = {'type': t, 'name': name, 'generic': [], 'port': [], 'signal': [], 'alias': [], 'const': [], 'inst': []}
+    if k in outline['entity']:
+        info['generic'] = outline['entity'][k]['generic']
+        info['port'] = outline['entity'][k]['port']
+    x = outline['package'].get(k) if t == 'package' else outline['architecture'].get(k)
+    if x:
+        for n in ['signal', 'const', 'alias', 'inst']:
+            if n in x:
+                info[n] = x[n]
+    info['func'] = outline['func']
+    info['proc'] = outline['proc']
+    info['process'] = outline['process']
+    return info
+
 ###############################################################################
 # Parse an architecture for all signals declaration
 
-def get_signals(flines,name=r'\w+'):
+def get_signals(flines,name=r'\w+', cleaned=False):
     # Remove all comments
-    flines = clean_comment(flines)
+    if not cleaned:
+        flines = clean_comment(flines)
     # Find the signals declaration part and extract module & architecture name
     re_str = r'(?si)^\s*architecture\s+(?P<arch>\w+)\s+of\s+(?P<name>'+name+r')\s+is(?P<decl>.*?)\bbegin\b'
     m = re.search(re_str,flines, flags=re.MULTILINE)
@@ -233,51 +734,3 @@ def get_signals(flines,name=r'\w+'):
     # print(info)
     return info
 
-
-# Retrieve the list of functions inside a block
-def get_function_list(txt,name, cleaned=False):
-    if not cleaned:
-        txt = clean_comment(txt)
-    # Remove function/procedure to avoid the end;
-    re_str_func = r'(?si)(?P<type>function)\s+(?P<name>\w+)\s*\((?P<args>.*?)\)\s*return(?P<ret>.*?)\b(?P<term>is)'
-    info = {}
-    for m in re.finditer(re_str_func,txt):
-        n = m.group('name')
-        if n in info:
-            continue
-        info[n] = {'return':m.group('name'), 'args': []}
-        args = []
-        for ma in re.finditer(re_args, m.group('args'), flags=re.MULTILINE):
-            info[n]['args'] += get_type_info_from_match('',ma)
-    # print(info)
-    return info
-
-# Retrieve the list of procedure inside a block
-def get_procedure_list(txt,name, cleaned=False):
-    if not cleaned:
-        txt = clean_comment(txt)
-    # Remove function/procedure to avoid the end;
-    re_str_proc = r'(?si)(?P<type>procedure)\s+(?P<name>\w+)\s*\((?P<args>.*?)\)\s*(?P<term>is|;)'
-    info = {}
-    for m in re.finditer(re_str_proc,txt):
-        n = m.group('name')
-        if n in info:
-            continue
-        info[n] = {'args': []}
-        # print(m.groups())
-        for ma in re.finditer(re_args, m.group('args')+';', flags=re.MULTILINE):
-            # print(ma.groups())
-            info[n]['args'] += get_type_info_from_match('',ma)
-    # print(info)
-    return info
-
-# Retrieve the list of process inside a block
-def get_process_list(txt,name, cleaned=False):
-    if not cleaned:
-        txt = clean_comment(txt)
-    # Remove function/procedure to avoid the end;
-    re_str_proc = r'(?si)(?P<name>\w+)\s*:\s*(?P<type>process)'
-    info = []
-    for m in re.finditer(re_str_proc,txt):
-        info.append(m.group('name'))
-    return info
@@ -1,11 +1,13 @@
 import sublime, sublime_plugin
-import re, string, os, sys, functools, mmap, imp
+import re, string, os, sys, functools, mmap, imp, threading
 
 try:
+    from . import vhdl_index
     from .util import vhdl_util
     from .util import sublime_util
 except ImportError:
     sys.path.append(os.path.join(os.path.dirname(__file__), "util"))
+    import vhdl_index
     import vhdl_util
     import sublime_util
 
@@ -15,34 +17,96 @@ def plugin_loaded():
     imp.reload(sublime_util)
 
 ############################################################################
+# With Sublime Text 4 the completions are resolved outside the UI thread: a deferred
+# completion list is returned and filled once resolved, or with the completions already
+# found when the timeout (vhdl.autocomplete_timeout) expires. If none was found yet
+# (e.g. record or port map completion, or cold caches) the list waits for the resolution.
+# With Sublime Text 3 the completions are resolved immediately.
 class VerilogAutoComplete(sublime_plugin.EventListener):
 
     def on_query_completions(self, view, prefix, locations):
         # don't change completion if we are not in a VHDL file
         if not view.match_selector(locations[0], 'source.vhdl'):
             return []
-        # Init class members
-        self.settings = view.settings()
-        self.debug = self.settings.get("vhdl.debug")
-        if self.settings.get("vhdl.disable_autocomplete", True):
+        settings = view.settings()
+        if settings.get("vhdl.disable_autocomplete", True):
             return []
-        self.view = view
         # Completion only for first selection
         r = view.sel()[0]
-        scope = view.scope_name(r.a)
         # If there is a prefix, allow sublime to provide completion ?
         flag = 0
         if(prefix==''):
             flag = sublime.INHIBIT_WORD_COMPLETIONS | sublime.INHIBIT_EXPLICIT_COMPLETIONS
+        if not hasattr(sublime,'CompletionList'):
+            req = VhdlCompletionRequest(view, True)
+            return (req.get_completions(r,prefix), flag)
+        req = VhdlCompletionRequest(view)
+        cl = sublime.CompletionList()
+        def deliver(completion, final):
+            if req.set_done(completion, final):
+                cl.set_completions(completion, flag)
+        sublime.set_timeout_async(lambda: deliver(req.get_completions(r,prefix), True), 0)
+        timeout = settings.get("vhdl.autocomplete_timeout", 200)
+        if timeout >= 0:
+            sublime.set_timeout(lambda: deliver(list(req.partial), False), timeout)
+        return cl
+
+############################################################################
+# Resolution of the completions at one location.
+# Completions found before the end of the resolution are available in partial.
+# A synchronous request (resolved on the UI thread, Sublime Text 3) only uses the project
+# index and the symbol tries already in memory: their loading/build is never waited for.
+class VhdlCompletionRequest():
+
+    def __init__(self, view, sync=False):
+        self.view = view
+        self.sync = sync
+        self.settings = view.settings()
+        self.debug = self.settings.get("vhdl.debug")
+        self.partial = []
+        self.done = False
+        self.lock = threading.Lock()
+
+    # Called from the UI thread (timeout) and the async thread (resolution):
+    # return True if the completions must be delivered, i.e. for the first final
+    # result or the first non-empty partial one
+    def set_done(self, completion, final):
+        with self.lock:
+            if self.done or not (final or completion):
+                return False
+            self.done = True
+            return True
+
+    # Return the key of the project of the view, None if there is no project index available
+    def get_project(self):
+        w = self.view.window()
+        if not w or not w.folders():
+            return None
+        proj = vhdl_index.window_key(w)
+        if self.sync:
+            index = vhdl_index.get_loaded_index(proj)
+        else:
+            index = vhdl_index.get_index(proj, w.folders())
+        return proj if index else None
+
+    def get_completions(self, r, prefix):
+        pos = r.b
+        scope = self.view.scope_name(r.a)
         r, line, prev_word, prev_symb, scope_start = self.get_full_prefix(r,prefix)
         completion = []
         if self.debug:
             print('[VHDL::Autocomplete] prefix="{}" previous symbol="{}" previous word="{}" line="{}" scope={} / {}'.format(prefix,prev_symb,prev_word,line,scope,scope_start))
         if prev_symb == '.' :
         	completion = self.dot_completion(r)
-
-        return (completion, flag)
-
+        elif 'comment' in scope or 'string' in scope:
+            pass
+        elif 'meta.block.parenthetical_list.portmap' in scope:
+            completion = self.port_map_completion(pos,prefix,scope)
+            if completion is None and prefix:
+                completion = self.identifier_completion(prefix)
+        elif prefix:
+            completion = self.identifier_completion(prefix)
+        return completion
 
     # Extract Full word and potentially symbol before completion request
     def get_full_prefix(self,r,prefix):
@@ -117,7 +181,7 @@ class VerilogAutoComplete(sublime_plugin.EventListener):
 
         # Check for multiple level of hierarchy
         cnt = 1
-        autocomplete_max_lvl = 2 #self.settings.get("vhdl.autocomplete_max_lvl",2)
+        autocomplete_max_lvl = self.settings.get("vhdl.autocomplete_max_lvl",5)
         while r.a>1 and self.view.substr(sublime.Region(r.a-1,r.a))=='.' and (cnt < autocomplete_max_lvl or autocomplete_max_lvl<0):
             # check previous char for array selection
             c = self.view.substr(sublime.Region(r.a-2,r.a-1))
@@ -133,44 +197,110 @@ class VerilogAutoComplete(sublime_plugin.EventListener):
         if (cnt >= autocomplete_max_lvl and autocomplete_max_lvl>=0):
             print("[VHDL::dot_completion] Reached max hierarchy level for autocompletion. You can change setting vhdl.autocomplete_max_lvl")
             return completion
-        w = str.rstrip(self.view.substr(r))
-        txt = self.view.substr(sublime.Region(0, self.view.line(r).b))
-        ti = vhdl_util.get_type_info(txt,w,4) # TODO: add function to retrieve type through multiple level of hierarchy
-        if self.debug: print('[VHDL::dot_completion] Word = {} -> type = {}'.format(w,ti));
-        if not ti or not ti['type'] or ti['type'] in ['std_logic','std_logic_vector','bit','bit_vector','string','integer','real','time','boolean']:
-            return completion
-
-        # Try to find type info: first in current file
-        #check first in current file
-        tti = vhdl_util.get_type_info(txt,ti['type'],4)
-        if not tti or not tti['type']:
-            filelist = self.view.window().lookup_symbol_in_index(ti['type'])
-            # print(filelist);
-            if filelist:
-                file_ext = tuple(self.settings.get('vhdl.ext',['vhd','vhdl']))
-                file_checked = []
-                for f in filelist:
-                    fname = sublime_util.normalize_fname(f[0])
-                    if fname in file_checked:
-                        continue
-                    file_checked.append(fname)
-                    if fname.lower().endswith(file_ext):
-                        # print(w + ' of type ' + ti['type'] + ' defined in ' + str(fname))
-                        tti = vhdl_util.get_type_info_file(fname,ti['type'],4)
-                        if tti['type']:
-                            break
-        if self.debug: print('[VHDL::dot_completion] => type = {}'.format(tti));
-        # print('[VHDL::dot_completion] => type = {}'.format(tti));
-        if not tti or tti['type']!='record':
+        # Remove array selection and resolve the fields of the last level through the record cache
+        w = re.sub(r'\s+','',self.view.substr(r))
+        while '(' in w:
+            w_ = re.sub(r'\([^()]*\)','',w)
+            if w_ == w:
+                break
+            w = w_
+        fields = vhdl_index.get_record_fields(self.view,w)
+        if self.debug: print('[VHDL::dot_completion] Word = {} -> fields = {}'.format(w,fields));
+        if not fields:
             return completion
-        completion = self.record_completion(tti['decl'])
+        completion = self.record_completion(fields)
         return completion
 
 
-    def record_completion(self,decl):
+    # Completion of identifiers declared in the view or anywhere in the project (cf vhdl_index.SymbolTrie)
+    def identifier_completion(self,prefix):
+        max_items = self.settings.get('vhdl.autocomplete_max_items',100)
+        c = self.partial
+        seen = set()
+        def add(syms):
+            for name,kind,detail in syms:
+                k = (name.lower(),kind)
+                if k in seen or (max_items>=0 and len(c)>=max_items):
+                    continue
+                seen.add(k)
+                desc = kind + ' ' + detail if detail else kind
+                c.append([name+'\t'+desc,name])
+        trie = vhdl_index.get_view_trie(self.view,True,not self.sync)
+        if trie:
+            add(trie.lookup(prefix,max_items))
+        proj = self.get_project() if max_items<0 or len(c)<max_items else None
+        if proj:
+            trie = vhdl_index.get_symbol_trie(proj)
+            if trie:
+                add(trie.lookup(prefix,max_items))
+        if self.debug: print('[VHDL::identifier_completion] prefix={} -> {} symbols'.format(prefix,len(c)))
+        return c
+
+    # Completion of the formal generics/ports in a generic/port map, from the ports of the
+    # entity/component cached in the project index (or declared in the view).
+    # Return None if the position is not on a formal.
+    def port_map_completion(self,pos,prefix,scope):
+        if 'meta.block.entity_instantiation' in scope:
+            r_inst = sublime_util.expand_to_scope(self.view,'meta.block.entity_instantiation',sublime.Region(pos,pos))
+        elif 'meta.block.component_instantiation' in scope:
+            r_inst = sublime_util.expand_to_scope(self.view,'meta.block.component_instantiation',sublime.Region(pos,pos))
+        else:
+            return None
+        txt = vhdl_util.clean_comment(self.view.substr(sublime.Region(r_inst.a,pos-len(prefix))),True)
+        m = re.search(r'(?si)(?:\w+\.)?(?P<mname>\w+)(?:\s*\(\s*\w+\s*\))?\s+(?:port|generic)\s+map\b',txt)
+        ml = list(re.finditer(r'(?si)\b(?P<kind>port|generic)\s+map\s*\(',txt))
+        if not m or not ml:
+            return None
+        # Keep only the current element of the map: it must not contain an association yet
+        elt = ml[-1].group(0)[-1] + txt[ml[-1].end():]
+        while True:
+            elt_ = re.sub(r'\([^()]*\)','',elt)
+            if elt_ == elt:
+                break
+            elt = elt_
+        if elt.count('(') != 1:
+            return None
+        elt = elt.split('(')[-1].split(',')[-1]
+        if '=>' in elt or ')' in elt:
+            return None
+        # Ports of the entity
+        info = None
+        w = self.view.window()
+        mname = m.group('mname')
+        proj = self.get_project()
+        if proj:
+            info = vhdl_index.get_ports(proj, mname)
+        if not info:
+            info = vhdl_index.get_view_ports(self.view, mname)
+        if not info and w:
+            file_ext = tuple(self.settings.get('vhdl.ext',['vhd','vhdl']))
+            for f in w.lookup_symbol_in_index(mname):
+                fname = sublime_util.normalize_fname(f[0])
+                if fname.lower().endswith(file_ext):
+                    try:
+                        info = vhdl_util.get_ports_file(fname,re.escape(mname))
+                    except OSError:
+                        continue
+                    if info:
+                        break
+        if self.debug: print('[VHDL::port_map_completion] module={} -> {}'.format(mname,info))
+        if not info:
+            return None
+        # Propose only formals not yet associated
+        txt_map = self.view.substr(sublime.Region(ml[-1].end()+r_inst.a,r_inst.b))
+        txt_map = re.split(r'(?i)\bport\s+map\b',txt_map)[0]
+        used = set([x.lower() for x in re.findall(r'(\w+)\s*(?:\([^)]*\))?\s*=>',txt_map)])
+        c = []
+        for ti in info['port' if ml[-1].group('kind').lower()=='port' else 'param']:
+            if ti['name'].lower() in used:
+                continue
+            desc = ti['dir'] + ' ' + ti['type'].strip() if ti.get('dir') else ti['type'].strip()
+            c.append([ti['name']+'\t'+desc,ti['name']+' => '])
+        return c
+
+    def record_completion(self,fields):
         c = []
-        fti = vhdl_util.get_all_type_info_from_record(decl)
-        for f in fti:
+        for f in fields:
             f_type = f['type']
             m = re.search(r'\[.*\]', f['decl'])
             if m:
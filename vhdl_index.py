@@ -0,0 +1,940 @@
+import sublime, sublime_plugin
+import re, string, os, sys, json, hashlib, imp, threading, collections
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .util import vhdl_util
+    from .util import sublime_util
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(__file__), "util"))
+    import vhdl_util
+    import sublime_util
+
+# Make sure util pythons are reloaded
+def plugin_loaded():
+    imp.reload(vhdl_util)
+    imp.reload(sublime_util)
+
+############################################################################
+# Project index: summary of every VHDL file of a project
+#  - files: dictionnary fname -> {mtime, size, inode, entity, component, decl_line, architecture, package, ports, inst, symbols, package_decl, subprograms}
+#  - dirs : stat snapshot of directories, dname -> [mtime, VHDL files, sub-directories]
+#  - folders: list of project folders
+# The index is saved in the cache directory so that only files modified
+# since the last session need to be parsed again.
+
+INDEX_VERSION = 8
+INDEX_EXT = ('.vhd','.vho','.vhdl')
+
+project_index = {}
+
+# Key of a project in the in-memory indexes and name of its cache file: the project
+# file, or the folder list when there is no project file (windows without project
+# file must not share their index)
+def index_key(projname, folders):
+    return projname if projname else '\n'.join(sorted(folders))
+
+def window_key(w):
+    return index_key(w.project_file_name(), w.folders())
+
+def index_fname(proj):
+    h = hashlib.md5(proj.encode('utf-8')).hexdigest()
+    return os.path.join(sublime.cache_path(), 'Smart VHDL', 'index_{}.json'.format(h))
+
+def load_index(proj, folders):
+    index = {'version': INDEX_VERSION, 'files': {}, 'dirs': {}, 'folders': folders}
+    try:
+        with open(index_fname(proj)) as f:
+            d = json.load(f)
+        if d.get('version') == INDEX_VERSION:
+            index = d
+    except (OSError, ValueError):
+        pass
+    return index
+
+def save_index(proj, index):
+    fname = index_fname(proj)
+    try:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        # Write in a temporary file first to never leave a partial index
+        with open(fname + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(fname + '.tmp', fname)
+    except OSError as e:
+        print('[SmartVHDL] Unable to save project index {} : {}'.format(fname,e))
+
+# Return the index of a project (cf index_key), loading it from the cache if needed.
+# Return None if the index was never built.
+def get_index(proj, folders):
+    if proj not in project_index:
+        index = load_index(proj, folders)
+        if not index['files']:
+            return None
+        project_index[proj] = index
+    return project_index[proj]
+
+# Return the index of a project only if already in memory (never blocks on the cache file)
+def get_loaded_index(proj):
+    return project_index.get(proj)
+
+# Parse a file for the index
+def parse_file(fname, st):
+    try:
+        with open(fname, errors='replace') as f:
+            finfo = vhdl_util.get_file_info(f.read())
+    except OSError:
+        finfo = vhdl_util.get_file_info('')
+    finfo['mtime'] = st.st_mtime
+    finfo['size'] = st.st_size
+    finfo['inode'] = st.st_ino
+    return finfo
+
+# Check if a file changed since it was indexed
+def is_stale(finfo, st):
+    return finfo['mtime'] != st.st_mtime or finfo['size'] != st.st_size or finfo['inode'] != st.st_ino
+
+# List VHDL files of a folder (recursively) using the snapshot of the previous scan:
+# a directory with the same mtime has the same entries and does not need to be listed again.
+def list_files(folder, dirs, new_dirs):
+    fl = []
+    dl = [folder]
+    while dl:
+        dname = dl.pop()
+        try:
+            st = os.stat(dname)
+        except OSError:
+            continue
+        entry = dirs.get(dname)
+        if not entry or entry[0] != st.st_mtime:
+            entry = [st.st_mtime, [], []]
+            try:
+                names = os.listdir(dname)
+            except OSError:
+                names = []
+            for n in names:
+                p = os.path.join(dname,n)
+                if os.path.isdir(p):
+                    if not os.path.islink(p):
+                        entry[2].append(n)
+                elif n.lower().endswith(INDEX_EXT):
+                    entry[1].append(n)
+        new_dirs[dname] = entry
+        fl += [os.path.join(dname,n) for n in entry[1]]
+        dl += [os.path.join(dname,n) for n in entry[2]]
+    return fl
+
+# Update the index of a project by diffing a stat snapshot of its folders
+# with the previous one: only added or modified files are parsed.
+# The scan runs on its own thread (never on the Sublime async thread, which would block
+# hovers/completions until the end of the scan) and the stat/read/parse of files is spread
+# across a pool of threads (mainly to hide I/O latency on network drives).
+# A new scan of the same project cancels the one ongoing: callbacks waiting for the
+# cancelled scan are called with the index of the scan replacing it. If the scan fails,
+# callbacks are called with the previous index.
+scan_state = {}
+scan_lock = threading.Lock()
+
+# Start a scan of a project in background: callback(index) is called at the end of the scan
+def start_scan(proj, folders, callback=None):
+    with scan_lock:
+        st = scan_state.setdefault(proj, {'id': 0, 'callbacks': []})
+        st['id'] += 1
+        sid = st['id']
+        if callback:
+            st['callbacks'].append(callback)
+    def run():
+        try:
+            index = scan_index(proj, folders, sid)
+        except Exception as e:
+            # Waiters must be released even if the scan fails: they get the previous index
+            print('[SmartVHDL] Project index update failed: {}'.format(e))
+            index = project_index.get(proj) or {'version': INDEX_VERSION, 'files': {}, 'dirs': {}, 'folders': folders}
+        with scan_lock:
+            if index is None or st['id'] != sid:
+                return
+            callbacks = st['callbacks']
+            st['callbacks'] = []
+        for cb in callbacks:
+            cb(index)
+    threading.Thread(target=run, daemon=True).start()
+
+# Update the index of a project and wait for the end of the scan (must not be called from the UI thread)
+def update_index(proj, folders):
+    done = threading.Event()
+    res = {}
+    def on_done(index):
+        res['index'] = index
+        done.set()
+    start_scan(proj, folders, on_done)
+    done.wait()
+    return res['index']
+
+# Scan of a project (cf start_scan): return None if cancelled by a more recent scan
+def scan_index(proj, folders, sid):
+    scan = scan_state[proj]
+    settings = sublime.load_settings('VHDL.sublime-settings')
+    nb_thread = max(1,settings.get('vhdl.index_threads',8))
+    index = get_index(proj, folders)
+    old_files = index['files'] if index else {}
+    old_dirs = index['dirs'] if index else {}
+    # List all VHDL files
+    fl = []
+    dirs = {}
+    for folder in folders:
+        fl += list_files(folder, old_dirs, dirs)
+        if scan['id'] != sid:
+            return None
+
+    def scan_file(fname):
+        if scan['id'] != sid:
+            return None
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None
+        finfo = old_files.get(fname)
+        if finfo and not is_stale(finfo, st):
+            return (fname, finfo, False)
+        return (fname, parse_file(fname, st), True)
+
+    files = {}
+    parsed = []
+    with ThreadPoolExecutor(max_workers=nb_thread) as executor:
+        for i,r in enumerate(executor.map(scan_file, fl)):
+            if r:
+                files[r[0]] = r[1]
+                if r[2]:
+                    parsed.append(r[0])
+            if i%500 == 0:
+                sublime.status_message('[SmartVHDL] Indexing project: {}/{} files'.format(i,len(fl)))
+    if scan['id'] != sid:
+        return None
+    removed = [f for f in old_files if f not in files]
+    index = {'version': INDEX_VERSION, 'files': files, 'dirs': dirs, 'folders': folders}
+    project_index[proj] = index
+    # Update derived indexes with files changed only
+    for fname in parsed + removed:
+        update_derived(proj, fname, old_files.get(fname), files.get(fname))
+    if parsed or removed or dirs != old_dirs:
+        save_index(proj, index)
+    if parsed or removed:
+        print('[SmartVHDL] Project index updated: {} file(s) parsed, {} removed'.format(len(parsed),len(removed)))
+    return index
+
+# Update the entry of one file in the index of all projects containing it
+# (typically on save) and schedule a save of the index
+def update_file(fname):
+    for proj,index in list(project_index.items()):
+        if fname not in index['files']:
+            continue
+        try:
+            st = os.stat(fname)
+        except OSError:
+            continue
+        old_finfo = index['files'][fname]
+        if not is_stale(old_finfo, st):
+            continue
+        finfo = parse_file(fname, st)
+        index['files'][fname] = finfo
+        update_derived(proj, fname, old_finfo, finfo)
+        schedule_save(proj)
+
+# Delayed save of the index: successive saves of files are grouped into one write
+save_pending = {}
+
+def schedule_save(proj):
+    if save_pending.get(proj):
+        return
+    save_pending[proj] = True
+    def do_save():
+        save_pending[proj] = False
+        if proj in project_index:
+            index = project_index[proj]
+            save_index(proj, index)
+    sublime.set_timeout_async(do_save, 5000)
+
+class VhdlIndexUpdateOnSave(sublime_plugin.EventListener):
+    def on_post_save_async(self, view):
+        fname = view.file_name()
+        if fname and fname.lower().endswith(INDEX_EXT):
+            update_file(fname)
+
+# Update all indexes derived from the project index for one file
+# (old_finfo/finfo set to None for added/removed file)
+def update_derived(proj, fname, old_finfo, finfo):
+    for d,add_file,remove_file in derived_index:
+        if proj in d:
+            if old_finfo:
+                remove_file(d[proj], fname, old_finfo)
+            if finfo:
+                add_file(d[proj], fname, finfo)
+
+# Display statistics on the project index and the file content cache
+class VhdlIndexInfoCommand(sublime_plugin.WindowCommand):
+
+    def run(self):
+        txt = ''
+        index = get_index(window_key(self.window), self.window.folders())
+        if index:
+            txt += 'Project index: {} files\n'.format(len(index['files']))
+        info = vhdl_util.get_file_cache_info()
+        txt += 'File cache: {} files, {:.1f}/{:.1f} MB\n'.format(info['files'],info['size']/1048576,info['budget']/1048576)
+        txt += '  hits={hits}, misses={misses}, evictions={evictions}\n'.format(**info)
+        sublime_util.print_to_panel(txt,'SmartVHDL')
+
+# List of files with entity/component (candidates for module instantiation)
+def module_files(index):
+    return sorted([fname for fname,finfo in index['files'].items() if finfo['module'] and finfo['size']])
+
+############################################################################
+# Reverse instantiation index of a project:
+#   entity/component name (lower case) -> {fname: [[instance label, line, library], ...]}
+# Built on first use from the project index, then updated with files changed only.
+inst_index = {}
+
+def add_inst_sites(rindex, fname, finfo):
+    for label,name,lib,line in finfo['inst']:
+        rindex.setdefault(name.lower(),{}).setdefault(fname,[]).append([label,line,lib])
+
+def remove_inst_sites(rindex, fname, finfo):
+    for x in finfo['inst']:
+        d = rindex.get(x[1].lower())
+        if d:
+            d.pop(fname,None)
+
+def get_inst_index(proj):
+    if proj not in inst_index:
+        if proj not in project_index:
+            return None
+        rindex = {}
+        for fname,finfo in project_index[proj]['files'].items():
+            add_inst_sites(rindex, fname, finfo)
+        inst_index[proj] = rindex
+    return inst_index[proj]
+
+# Return all instances of a module: dictionnary fname -> [[instance label, line, library], ...]
+def find_instances(proj, mname):
+    rindex = get_inst_index(proj)
+    if not rindex:
+        return {}
+    return rindex.get(mname.lower(),{})
+
+############################################################################
+# Design graph of a project:
+#  - arch: entity name (lower case) -> {fname: [architecture name, entity name, instances]}
+#  - decl: entity/component name (lower case) -> set of files declaring it
+# Built on first use from the project index, then updated with files changed only.
+design_graph = {}
+
+def add_graph_file(graph, fname, finfo):
+    for a in finfo['architecture']:
+        graph['arch'].setdefault(a[1].lower(),{})[fname] = a
+    for n in finfo['entity'] + finfo['component']:
+        graph['decl'].setdefault(n.lower(),set()).add(fname)
+
+def remove_graph_file(graph, fname, finfo):
+    for a in finfo['architecture']:
+        graph['arch'].get(a[1].lower(),{}).pop(fname,None)
+    for n in finfo['entity'] + finfo['component']:
+        graph['decl'].get(n.lower(),set()).discard(fname)
+
+def get_design_graph(proj):
+    if proj not in design_graph:
+        if proj not in project_index:
+            return None
+        graph = {'arch': {}, 'decl': {}}
+        for fname,finfo in project_index[proj]['files'].items():
+            add_graph_file(graph, fname, finfo)
+        design_graph[proj] = graph
+    return design_graph[proj]
+
+# Return the file defining the architecture of an entity and the list of its instances (label, type)
+# The list is None if no architecture is found.
+def get_submodules(proj, name):
+    graph = get_design_graph(proj)
+    d = graph['arch'].get(name.lower()) if graph else None
+    if not d:
+        return None, None
+    fname = sorted(d.keys())[0]
+    return fname, [tuple(x) for x in d[fname][2]]
+
+# Return the file and line declaring an entity (or a component if no entity is found),
+# (None, 0) if not declared in the project
+def find_decl(proj, name):
+    graph = get_design_graph(proj)
+    k = name.lower()
+    fnames = sorted(graph['decl'].get(k,[])) if graph else []
+    if not fnames:
+        return None, 0
+    files = project_index[proj]['files']
+    fnames.sort(key=lambda f: k not in [n.lower() for n in files[f]['entity']])
+    return fnames[0], files[fnames[0]].get('decl_line',{}).get(k,1)
+
+# Check if an entity/component is declared somewhere in the project
+def is_declared(proj, name):
+    graph = get_design_graph(proj)
+    return bool(graph and graph['decl'].get(name.lower()))
+
+# Return the generics/ports of an entity/component from the project index
+# (cf vhdl_util.get_ports), entity declaration first. None if not found.
+def get_ports(proj, name):
+    graph = get_design_graph(proj)
+    fnames = sorted(graph['decl'].get(name.lower(),[])) if graph else []
+    info = None
+    for fname in fnames:
+        for n,p in project_index[proj]['files'][fname]['ports'].items():
+            if n.lower() == name.lower() and (not info or p['type'].lower() == 'entity'):
+                info = p
+    return info
+
+############################################################################
+# Statistics of an elaborated hierarchy, computed on the graph of entities
+# without expanding it (shared subtrees are computed once):
+#  - size : number of instances in the subtree of each entity
+#  - count: number of occurrences of each entity in the elaborated tree
+# Entities are keyed by their lower-case name (VHDL is case insensitive), the name
+# as first written (top first) is kept in 'name' for display.
+# children(name) returns the list of (label, type) of an entity (None for a leaf).
+# Recursive instantiations are reported in 'loops' and not followed.
+def get_hierarchy_stats(top, children):
+    ktop = top.lower()
+    names = {ktop: top}
+    nodes = {ktop: children(top) or []}
+    state = {ktop: 1} # 1: being visited, 2: done
+    order = [] # Post-order: an entity always comes after all its sub-entities
+    loops = set()
+    stack = [(ktop,0)]
+    while stack:
+        name,i = stack.pop()
+        il = nodes[name]
+        if i < len(il):
+            stack.append((name,i+1))
+            t = il[i][1].lower()
+            if t not in state:
+                state[t] = 1
+                names[t] = il[i][1]
+                nodes[t] = children(il[i][1]) or []
+                stack.append((t,0))
+            elif state[t] == 1:
+                loops.add((name,t))
+        else:
+            state[name] = 2
+            order.append(name)
+    size = {}
+    for name in order:
+        size[name] = sum([1 + size[x[1].lower()] for x in nodes[name] if (name,x[1].lower()) not in loops])
+    count = {name: 0 for name in order}
+    count[ktop] = 1
+    for name in reversed(order):
+        for x in nodes[name]:
+            if (name,x[1].lower()) not in loops:
+                count[x[1].lower()] += count[name]
+    return {'top': ktop, 'name': names, 'nodes': nodes, 'order': order, 'size': size, 'count': count, 'loops': sorted(loops)}
+
+############################################################################
+# Symbol trie: prefix tree of the symbols declared in a project (cf vhdl_util.get_symbols),
+# used for identifier completion. Keys are lower-case so that the case-insensitive
+# match is done once when a symbol is added instead of on every lookup.
+# Each node is a dictionnary character -> node, the symbols ending on a node
+# are stored in the entry '' as {(name, kind, detail): set of files}.
+# Built in background on first use from the project index, then updated with files changed only.
+# Tries are used from several threads (completion, scan, save): add/remove/lookup are done under a lock.
+class SymbolTrie():
+
+    def __init__(self):
+        self.root = {}
+        self.lock = threading.Lock()
+        # Updates of the project index received while the trie is built (None once built)
+        self.pending = None
+
+    def add(self, sym, fname):
+        with self.lock:
+            node = self.root
+            for c in sym[0].lower():
+                node = node.setdefault(c,{})
+            node.setdefault('',{}).setdefault(tuple(sym),set()).add(fname)
+
+    def remove(self, sym, fname):
+        with self.lock:
+            node = self.root
+            for c in sym[0].lower():
+                node = node.get(c)
+                if node is None:
+                    return
+            d = node.get('',{})
+            files = d.get(tuple(sym))
+            if files is not None:
+                files.discard(fname)
+                if not files:
+                    d.pop(tuple(sym))
+
+    # Return the list of symbols (name, kind, detail) starting with prefix (case insensitive),
+    # limited to max_items (-1 for no limit). The walk is breadth-first so that the shortest
+    # names (exact match first) are kept, and stops as soon as enough symbols are found.
+    def lookup(self, prefix, max_items=-1):
+        with self.lock:
+            node = self.root
+            for c in prefix.lower():
+                node = node.get(c)
+                if node is None:
+                    return []
+            l = []
+            queue = collections.deque([node])
+            while queue:
+                n = queue.popleft()
+                for c,child in sorted(n.items()):
+                    if c:
+                        queue.append(child)
+                    else:
+                        l += child.keys()
+                        if max_items>=0 and len(l)>=max_items:
+                            return l[:max_items]
+            return l
+
+# Project symbol tries: registered before being built, so that the updates of the
+# project index done during the build (scan, save) are queued and applied at the end.
+symbol_trie = {}
+
+def add_symbols(trie, fname, finfo):
+    with trie.lock:
+        if trie.pending is not None:
+            trie.pending.append((fname, None, finfo))
+            return
+    for sym in finfo.get('symbols',[]):
+        trie.add(sym, fname)
+
+def remove_symbols(trie, fname, finfo):
+    with trie.lock:
+        if trie.pending is not None:
+            trie.pending.append((fname, finfo, None))
+            return
+    for sym in finfo.get('symbols',[]):
+        trie.remove(sym, fname)
+
+# Return the symbol trie of a project, or None if not available yet (the build is then started in background)
+def get_symbol_trie(proj):
+    trie = symbol_trie.get(proj)
+    if trie:
+        return trie if trie.pending is None else None
+    if proj not in project_index:
+        return None
+    trie = SymbolTrie()
+    trie.pending = []
+    if symbol_trie.setdefault(proj, trie) is not trie:
+        return None
+    def build():
+        for fname,finfo in list(project_index[proj]['files'].items()):
+            for sym in finfo.get('symbols',[]):
+                trie.add(sym, fname)
+        # Apply the updates queued during the build
+        while True:
+            with trie.lock:
+                updates = trie.pending
+                trie.pending = [] if updates else None
+            if not updates:
+                break
+            for fname,old_finfo,finfo in updates:
+                if old_finfo:
+                    for sym in old_finfo.get('symbols',[]):
+                        trie.remove(sym, fname)
+                if finfo:
+                    for sym in finfo.get('symbols',[]):
+                        trie.add(sym, fname)
+    sublime.set_timeout_async(build, 0)
+    return None
+
+############################################################################
+# Subprogram index of a project: name (lower case) -> {fname: [signatures]}
+# (cf vhdl_util.get_signatures), all overloads being kept.
+# Built on first use from the project index, then updated with files changed only.
+subprogram_index = {}
+
+def add_subprograms(sindex, fname, finfo):
+    for sig in finfo.get('subprograms',[]):
+        sindex.setdefault(sig['name'].lower(),{}).setdefault(fname,[]).append(sig)
+
+def remove_subprograms(sindex, fname, finfo):
+    for sig in finfo.get('subprograms',[]):
+        d = sindex.get(sig['name'].lower())
+        if d:
+            d.pop(fname,None)
+
+def get_subprogram_index(proj):
+    if proj not in subprogram_index:
+        if proj not in project_index:
+            return None
+        sindex = {}
+        for fname,finfo in project_index[proj]['files'].items():
+            add_subprograms(sindex, fname, finfo)
+        subprogram_index[proj] = sindex
+    return subprogram_index[proj]
+
+# Return all signatures of a subprogram in the project: list of (fname, signature),
+# one per signature key (a declaration in a package and its body are reported once)
+def find_subprograms(proj, name):
+    sindex = get_subprogram_index(proj)
+    l = []
+    keys = set()
+    for fname,sigs in sorted(sindex.get(name.lower(),{}).items()) if sindex else []:
+        for sig in sigs:
+            if sig['key'] not in keys:
+                keys.add(sig['key'])
+                l.append((fname,sig))
+    return l
+
+############################################################################
+# Package index of a project: package name (lower case) -> {fname: {name, spec, body, decl}}
+# (cf vhdl_util.get_package_decl). Combined with the use clauses of a file, it gives
+# directly the file declaring a type without scanning other candidates.
+# Built on first use from the project index, then updated with files changed only.
+package_index = {}
+
+def add_packages(pindex, fname, finfo):
+    for k,p in finfo.get('package_decl',{}).items():
+        pindex.setdefault(k,{})[fname] = p
+
+def remove_packages(pindex, fname, finfo):
+    for k in finfo.get('package_decl',{}):
+        pindex.get(k,{}).pop(fname,None)
+
+def get_package_index(proj):
+    if proj not in package_index:
+        if proj not in project_index:
+            return None
+        pindex = {}
+        for fname,finfo in project_index[proj]['files'].items():
+            add_packages(pindex, fname, finfo)
+        package_index[proj] = pindex
+    return package_index[proj]
+
+# Return the file of a package declaring name (None if not found): files with the package declaration first
+def find_in_package(proj, pkg, name):
+    pindex = get_package_index(proj)
+    d = pindex.get(pkg.lower(),{}) if pindex else {}
+    for fname,p in sorted(d.items(), key=lambda x: (not x[1]['spec'], x[0])):
+        if name.lower() in p['decl']:
+            return fname
+    return None
+
+# Indexes derived from the project index: (dictionnary project key -> index, add function, remove function)
+derived_index = [
+    (inst_index  , add_inst_sites, remove_inst_sites),
+    (design_graph, add_graph_file, remove_graph_file),
+    (symbol_trie , add_symbols   , remove_symbols   ),
+    (subprogram_index, add_subprograms, remove_subprograms),
+    (package_index, add_packages, remove_packages),
+]
+
+############################################################################
+# View index: declaration index of the content of an open view, kept up to date
+# while editing. Only the chunks of text modified since the last update are
+# parsed again (cf vhdl_util.update_decl_index).
+#  - view_index: buffer id -> {cc: change count, clean: text without comments, index, chunks, outline, trie, symbols, ...}
+# Entries are keyed by buffer so that all views of a file (in any window) share them.
+
+view_index = {}
+view_index_lock = threading.Lock()
+view_index_req = {}
+
+# Return the entry of a view, updated if the view was modified since the last update.
+# With stale=True, an existing entry is returned as is: used when the latest edits
+# do not matter (e.g. identifier completion on each keystroke), the entry being
+# updated once the user stops typing (cf VhdlViewIndexListener).
+def get_view_info(view, stale=False):
+    with view_index_lock:
+        e = view_index.get(view.buffer_id())
+        if e and (stale or e['cc'] == view.change_count()):
+            return e
+        cc = view.change_count()
+        txt = vhdl_util.clean_comment(view.substr(sublime.Region(0, view.size())))
+        index,chunks = vhdl_util.update_decl_index(txt, e['chunks'] if e else None)
+        ne = {'cc': cc, 'clean': txt, 'index': index, 'chunks': chunks}
+        # The symbol trie is kept from one version to the next, with the chunks changed only
+        if e and 'trie' in e:
+            update_view_trie(e['trie'], e['symbols'], chunks)
+            ne['trie'] = e['trie']
+            ne['symbols'] = e['symbols']
+        view_index[view.buffer_id()] = ne
+    return ne
+
+# Declaration index of a view
+def get_view_index(view):
+    return get_view_info(view)['index']
+
+# Text without comments of a view
+def get_view_clean(view):
+    return get_view_info(view)['clean']
+
+# Outline of a view (cf vhdl_util.get_outline), extracted once per version of the view.
+# A view without modification uses the outline of its file, cached on the file date
+def get_view_outline(view):
+    fname = view.file_name()
+    if fname and not view.is_dirty():
+        try:
+            return vhdl_util.get_outline_file(fname)
+        except OSError:
+            pass
+    e = get_view_info(view)
+    if 'outline' not in e:
+        e['outline'] = vhdl_util.get_outline(e['clean'])
+    return e['outline']
+
+class VhdlViewIndexListener(sublime_plugin.EventListener):
+    # Update is delayed until the user stop typing
+    def on_modified_async(self, view):
+        if not view.match_selector(0,'source.vhdl'):
+            return
+        vid = view.buffer_id()
+        view_index_req[vid] = view_index_req.get(vid,0) + 1
+        req = view_index_req[vid]
+        def update():
+            if view_index_req.get(vid) == req and view.is_valid():
+                get_view_info(view)
+        sublime.set_timeout_async(update, view.settings().get('vhdl.view_index_delay',500))
+
+    def on_close(self, view):
+        view_index_req.pop(view.buffer_id(),None)
+        with view_index_lock:
+            view_index.pop(view.buffer_id(),None)
+
+############################################################################
+# Record cache: flattened field table of record types, nested records included,
+# so that completion of a.b.c. is a simple lookup once the type of a is known.
+#  - children: path of a field (lower case, '' for the record itself) -> list of fields
+#  - files   : fname -> mtime of all files used to resolve the record
+# Records declared in files are cached by (file, type name): the file declaring a type
+# is resolved first (cf find_type), and nested records are resolved from the file
+# declaring the record, so that a table does not depend on the view using it.
+# An entry is valid as long as none of its files was modified.
+# Tables used by a view are also kept in the view index entry (valid until the view
+# is modified), including those of records declared in the view itself.
+
+record_cache = {}
+
+scalar_type = [
+    'bit', 'bit_vector', 'boolean', 'character', 'integer', 'natural', 'positive', 'real', 'string', 'time',
+    'std_logic', 'std_ulogic', 'std_logic_vector', 'std_ulogic_vector', 'signed', 'unsigned'
+]
+
+# Return the declaration of a type and the file declaring it (None when declared in the view)
+def find_type(view, tname):
+    ti = vhdl_util.get_type_info_from_index(get_view_index(view), tname, 4)
+    if ti['type']:
+        return ti, None
+    fname = find_visible_decl(view, tname)
+    if fname:
+        ti = vhdl_util.get_type_info_file(fname, tname.split('.')[-1], 4)
+        if ti['type']:
+            return ti, fname
+    return find_type_in_symbols(view, tname)
+
+# Return the declaration of a type used in a file and the file declaring it:
+# the file itself, then the packages visible from the file (use clauses)
+def find_type_from_file(view, fname, tname):
+    try:
+        ti = vhdl_util.get_type_info_file(fname, tname.split('.')[-1], 4)
+        if ti['type'] and '.' not in tname:
+            return ti, fname
+        w = view.window()
+        proj = window_key(w) if w and w.folders() else None
+        if proj and get_index(proj, w.folders()):
+            dfname = find_in_uses(proj, vhdl_util.get_use_clauses_file(fname), tname)
+            if dfname:
+                ti = vhdl_util.get_type_info_file(dfname, tname.split('.')[-1], 4)
+                if ti['type']:
+                    return ti, dfname
+    except OSError:
+        pass
+    return find_type_in_symbols(view, tname)
+
+# Last resort: files of the Sublime symbol index declaring the type
+def find_type_in_symbols(view, tname):
+    tname = tname.split('.')[-1]
+    file_ext = tuple(view.settings().get('vhdl.ext',['vhd','vhdl']))
+    file_checked = set()
+    for f in view.window().lookup_symbol_in_index(tname):
+        fname = sublime_util.normalize_fname(f[0])
+        if fname in file_checked or not fname.lower().endswith(file_ext):
+            continue
+        file_checked.add(fname)
+        try:
+            ti = vhdl_util.get_type_info_file(fname, tname, 4)
+        except OSError:
+            continue
+        if ti['type']:
+            return ti, fname
+    return None, None
+
+def build_record_table(view, ti, fname):
+    table = {'children': {}, 'files': {}}
+    if fname:
+        table['files'][fname] = os.path.getmtime(fname)
+    stack = [('', ti['decl'], fname, set([ti['name'].lower()]))]
+    while stack:
+        path, decl, dfname, parents = stack.pop()
+        fields = vhdl_util.get_all_type_info_from_record(decl)
+        table['children'][path] = fields
+        for f in fields:
+            t = f['type'].split('(')[0].strip()
+            if t.lower() in scalar_type or t.lower() in parents:
+                continue
+            if dfname:
+                tti, tfname = find_type_from_file(view, dfname, t)
+            else:
+                tti, tfname = find_type(view, t)
+            if not tti or tti['type'] != 'record':
+                continue
+            if tfname:
+                table['files'][tfname] = os.path.getmtime(tfname)
+            fpath = f['name'].lower() if not path else path + '.' + f['name'].lower()
+            stack.append((fpath, tti['decl'], tfname, parents | set([t.lower()])))
+    return table
+
+def is_record_table_valid(table):
+    try:
+        return all(os.path.getmtime(f) == m for f,m in table['files'].items())
+    except OSError:
+        return False
+
+# Return the flattened field table of a record type (None if not a record)
+def get_record_table(view, tname):
+    key = tname.lower()
+    e = get_view_info(view)
+    records = e.setdefault('records', {})
+    if key in records:
+        return records[key]
+    ti, fname = find_type(view, tname)
+    if not ti or ti['type'] != 'record':
+        table = None
+    elif not fname:
+        table = build_record_table(view, ti, None)
+    else:
+        ckey = (fname, ti['name'].lower())
+        table = record_cache.get(ckey)
+        if not table or not is_record_table_valid(table):
+            table = build_record_table(view, ti, fname)
+            record_cache[ckey] = table
+    records[key] = table
+    return table
+
+# Return the fields of a variable or one of its sub-fields, e.g. get_record_fields(view,'a.b')
+# returns the fields of the record type of a.b (None if this is not a record)
+def get_record_fields(view, varname):
+    names = [n.strip().lower() for n in varname.split('.')]
+    ti = vhdl_util.get_type_info_from_index(get_view_index(view), names[0], 4)
+    if not ti or not ti['type']:
+        return None
+    t = ti['type'].split('(')[0].strip()
+    if t.lower() in scalar_type:
+        return None
+    table = get_record_table(view, t)
+    if not table:
+        return None
+    return table['children'].get('.'.join(names[1:]))
+
+# Symbol trie of a view: declarations of the view index and symbols (cf vhdl_util.get_symbols)
+# of each chunk of text, the chunk being used as the file of its symbols in the trie.
+# Built on first use, then updated with the chunks added/removed by each modification
+#  - symbols: chunk -> list of symbols added to the trie
+# Generics are taken from the entity declarations (cf vhdl_util.get_outline): the 'generic'
+# table of the declaration index also matches ports and instance/process labels.
+view_decl_kind = {'signal': 'signal', 'port': 'port', 'const': 'constant', 'record': 'type', 'alias': 'alias', 'alias_ref': 'alias'}
+
+def get_chunk_symbols(c, ci):
+    l = [(ti['name'], view_decl_kind[kind], (ti['type'] or '').strip()) for kind,d in ci.items() if kind in view_decl_kind for ti in d.values()]
+    if re.search(r'(?i)\bgeneric\b', c):
+        for ent in vhdl_util.get_outline(c)['entity'].values():
+            l += [(ti['name'], 'generic', (ti['type'] or '').strip()) for ti in ent['generic']]
+    return l + [tuple(sym) for sym in vhdl_util.get_symbols(c)]
+
+def update_view_trie(trie, symbols, chunks):
+    for c in [c for c in symbols if c not in chunks]:
+        for sym in symbols.pop(c):
+            trie.remove(sym, c)
+    for c,ci in chunks.items():
+        if c not in symbols:
+            symbols[c] = get_chunk_symbols(c, ci)
+            for sym in symbols[c]:
+                trie.add(sym, c)
+
+# With wait=False, the trie is returned only if already built (None otherwise, the build
+# being started in background): used when resolving on the UI thread.
+view_trie_pending = set()
+
+def get_view_trie(view, stale=False, wait=True):
+    if not wait:
+        e = view_index.get(view.buffer_id())
+        if e and 'trie' in e:
+            return e['trie']
+        vid = view.buffer_id()
+        if vid not in view_trie_pending:
+            view_trie_pending.add(vid)
+            def build():
+                try:
+                    get_view_trie(view, True)
+                finally:
+                    view_trie_pending.discard(vid)
+            sublime.set_timeout_async(build, 0)
+        return None
+    e = get_view_info(view, stale)
+    with view_index_lock:
+        if 'trie' not in e:
+            symbols = {}
+            trie = SymbolTrie()
+            update_view_trie(trie, symbols, e['chunks'])
+            e['symbols'] = symbols
+            e['trie'] = trie
+    return e['trie']
+
+# Generics/ports of an entity/component declared in a view, extracted once per version of the view
+def get_view_ports(view, name):
+    e = get_view_info(view)
+    ports = e.setdefault('ports', {})
+    key = name.lower()
+    if key not in ports:
+        ports[key] = vhdl_util.get_ports(e['clean'], re.escape(name), True)
+    return ports[key]
+
+# Signatures of a subprogram declared in a view, then in the project (cf find_subprograms).
+# The fname of signatures from the view is None.
+def get_signatures(view, name):
+    l = [(None,sig) for sig in vhdl_util.get_signatures(get_view_outline(view)) if sig['name'].lower() == name.lower()]
+    w = view.window()
+    if w and w.folders():
+        proj = window_key(w)
+        if get_index(proj, w.folders()):
+            keys = set([sig['key'] for _,sig in l])
+            fname = view.file_name()
+            l += [x for x in find_subprograms(proj, name) if x[1]['key'] not in keys and x[0] != fname]
+    return l
+
+# Use clauses of a view, extracted once per version of the view (cf vhdl_util.get_use_clauses)
+def get_view_uses(view):
+    e = get_view_info(view)
+    if 'uses' not in e:
+        e['uses'] = vhdl_util.get_use_clauses(e['clean'])
+    return e['uses']
+
+# Return the file declaring name in the packages visible through a list of use clauses
+# (None if not found). A selected name (pkg.name or lib.pkg.name) is looked up directly in its package.
+def find_in_uses(proj, uses, name):
+    n = name.lower().split('.')
+    if len(n) > 1:
+        return find_in_package(proj, n[-2], n[-1])
+    for lib,pkg,item in uses:
+        if item in ('all', n[0]):
+            fname = find_in_package(proj, pkg, n[0])
+            if fname:
+                return fname
+    return None
+
+# Return the file declaring name in the packages visible from a view (use clauses),
+# None if not found or if the project index is not available.
+def find_visible_decl(view, name):
+    w = view.window()
+    if not w or not w.folders():
+        return None
+    proj = window_key(w)
+    if not get_index(proj, w.folders()):
+        return None
+    return find_in_uses(proj, get_view_uses(view), name)
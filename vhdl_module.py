@@ -2,10 +2,12 @@ import sublime, sublime_plugin
 import re, string, os, sys, functools, mmap, imp
 
 try:
+    from . import vhdl_index
     from .util import vhdl_util
     from .util import sublime_util
 except ImportError:
     sys.path.append(os.path.join(os.path.dirname(__file__), "util"))
+    import vhdl_index
     import vhdl_util
     import sublime_util
 
@@ -51,6 +53,20 @@ def lookup_type(view, t, flag):
     return ti
 
 
+# Update the project index and the list of module files in background, then call callback
+def start_list_update(proj, callback=None):
+    global lmf_update_ongoing
+    lmf_update_ongoing = True
+    vhdl_index.start_scan(proj, sublime.active_window().folders(), functools.partial(on_list_updated,proj,callback))
+
+def on_list_updated(proj, callback, index):
+    global lmf_update_ongoing
+    sublime.status_message('List of module files updated')
+    list_module_files[proj] = vhdl_index.module_files(index)
+    lmf_update_ongoing = False
+    if callback:
+        sublime.set_timeout(callback, 0)
+
 ########################################
 # Create module instantiation skeleton #
 class VhdlModuleInstCommand(sublime_plugin.TextCommand):
@@ -69,56 +85,46 @@ class VhdlModuleInstCommand(sublime_plugin.TextCommand):
         #  - If no folder in current project, just list open files
         #  - if it exist use latest version and display panel immediately while running an update
         #  - if not display panel only when list is ready
-        projname = self.window.project_file_name()
+        proj = vhdl_index.window_key(self.window)
+        # Use the project index already in memory if available: loading it from the
+        # cache file is done in background, with the update of the list
+        if proj not in list_module_files and sublime.active_window().folders():
+            index = vhdl_index.get_loaded_index(proj)
+            if index:
+                list_module_files[proj] = vhdl_index.module_files(index)
         if not sublime.active_window().folders():
             list_module_files['__NONE__'] = []
             for v in self.window.views():
                 if v and v.file_name():
                     list_module_files['__NONE__'].append(os.path.abspath(v.file_name()))
             self.on_list_done('__NONE__')
-        elif projname not in list_module_files:
-            sublime.set_timeout_async(functools.partial(self.get_list_file,projname,functools.partial(self.on_list_done,projname)), 0)
+        elif proj not in list_module_files:
+            start_list_update(proj,functools.partial(self.on_list_done,proj))
             sublime.status_message('Please wait while module list is being built')
         elif not lmf_update_ongoing:
             # Create a copy so that the background update does not change the content of the list
-            list_module_files['__COPY__'] = list_module_files[projname][:]
+            list_module_files['__COPY__'] = list_module_files[proj][:]
             # Start background update of the list
-            sublime.set_timeout_async(functools.partial(self.get_list_file,projname), 0)
+            start_list_update(proj)
             # Display quick panel
             self.on_list_done('__COPY__')
 
-    def get_list_file(self, projname, callback=None):
-        global list_module_files
+    # Update the project index and the list of module files, waiting for the end of the scan
+    # (must not be called from the UI thread)
+    def get_list_file(self, proj, callback=None):
         global lmf_update_ongoing
         lmf_update_ongoing = True
-        lmf = []
-        for folder in sublime.active_window().folders():
-            for root, dirs, files in os.walk(folder):
-                for fn in files:
-                    if fn.lower().endswith(('.vhd','.vho','.vhdl')):
-                        ffn = os.path.join(root,fn)
-                        f = open(ffn)
-                        if os.stat(ffn).st_size:
-                            s = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-                            if s.find(b'entity') != -1:
-                                lmf.append(ffn)
-                            elif s.find(b'component') != -1:
-                                lmf.append(ffn)
-        sublime.status_message('List of module files updated')
-        list_module_files[projname] = lmf[:]
-        lmf_update_ongoing = False
-        if callback:
-            callback()
+        index = vhdl_index.update_index(proj, sublime.active_window().folders())
+        on_list_updated(proj, callback, index)
 
-    def on_list_done(self,projname):
-        self.window.show_quick_panel(list_module_files[projname], functools.partial(self.on_select_file_done,projname))
+    def on_list_done(self,proj):
+        self.window.show_quick_panel(list_module_files[proj], functools.partial(self.on_select_file_done,proj))
 
-    def on_select_file_done(self, projname, index):
+    def on_select_file_done(self, proj, index):
         if index >= 0:
-            fname = list_module_files[projname][index]
+            fname = list_module_files[proj][index]
             try:
-                with open(fname, "r") as f:
-                    flines = str(f.read())
+                flines = vhdl_util.read_file(fname)
                 self.ml=re.findall(r'^\s*entity\s+(\w+)\s+is',flines,re.MULTILINE);
                 if len(self.ml)<2:
                     self.view.run_command("vhdl_do_module_parse", {"args":{'fname': fname, 'mname':r'\w+'}})
@@ -1,12 +1,13 @@
 from __future__ import absolute_import
 
 import sublime, sublime_plugin
-import re, string, os, sys, functools, mmap, pprint, imp, threading
+import re, string, os, sys, functools, mmap, pprint, imp, threading, json, csv, difflib
 from collections import Counter
 from plistlib import readPlistFromBytes
 
 try:
     from . import vhdl_module
+    from . import vhdl_index
     from .util import vhdl_util
     from .util import sublime_util
     from .color_scheme_util import st_color_scheme_matcher
@@ -38,12 +39,17 @@ def plugin_loaded():
     global pref_settings
     pref_settings = sublime.load_settings('Preferences.sublime-settings')
     pref_settings.clear_on_change('reload')
-    pref_settings.add_on_change('reload',plugin_loaded)
+    pref_settings.add_on_change('reload',settings_changed)
     # Ensure the VHDL settings are properly reloaded when changed
     global vhdl_settings
     vhdl_settings = sublime.load_settings('VHDL.sublime-settings')
     vhdl_settings.clear_on_change('reload')
-    vhdl_settings.add_on_change('reload',plugin_loaded)
+    vhdl_settings.add_on_change('reload',settings_changed)
+    settings_changed()
+
+# Settings change: modules are not reloaded, so that the file cache and the
+# parsing caches of vhdl_util (and their statistics) are kept
+def settings_changed():
     global tooltip_flag
     if vhdl_settings.get('vhdl.tooltip_hide_on_move',True):
         tooltip_flag = sublime.HIDE_ON_MOUSE_MOVE_AWAY
@@ -51,6 +57,7 @@ def plugin_loaded():
         tooltip_flag = 0
     global show_ref
     show_ref = int(sublime.version()) >= 3145 and vhdl_settings.get('vhdl.tooltip_show_refs',True)
+    vhdl_util.set_file_cache_budget(vhdl_settings.get('vhdl.file_cache_size',32)*1024*1024)
     init_css()
 
 def init_css():
@@ -101,13 +108,17 @@ def init_css():
 ############################################################################
 # Help function to retrieve type
 
+# Note: the declaration index of the view is maintained while editing (cf vhdl_index)
 def type_info(view, t, region):
-    if region:
-        pos = view.line(region).b
-    else:
-        pos = self.view.size()
-    txt = view.substr(sublime.Region(0, pos))
-    tti = vhdl_util.get_type_info(txt,t,4)
+    tti = vhdl_util.get_type_info_from_index(vhdl_index.get_view_index(view),t,4)
+    # Type declared in a package visible from the view (use clauses)
+    if not tti or not tti['type']:
+        fname = vhdl_index.find_visible_decl(view,t)
+        if fname:
+            tti = vhdl_util.get_type_info_file(fname,t.split('.')[-1],4)
+            if tti['type']:
+                row,col = vhdl_util.get_rowcol(vhdl_util.get_line_table(vhdl_util.read_file(fname,True)),tti['pos'])
+                tti['fname'] = (fname,row+1,col+1)
     if not tti or not tti['type']:
         filelist = view.window().lookup_symbol_in_index(t)
         if filelist:
@@ -129,17 +140,15 @@ def type_info(view, t, region):
     # print(['[type_info] tti={}'.format(tti)])
     return tti
 
-def type_info_on_hier(view, varname, txt=None, region=None):
+def type_info_on_hier(view, varname, region=None):
     va = varname.split('.')
     ti = None
     scope = ''
-    if not txt and region:
-        txt = view.substr(sublime.Region(0, view.line(region).b))
     for i in range(0,len(va)):
         v = va[i].split('[')[0] # retrieve name without array part
         # Get type definition: first iteration is done inside current file
         if i==0:
-            ti = vhdl_util.get_type_info(txt, v,4)
+            ti = vhdl_util.get_type_info_from_index(vhdl_index.get_view_index(view), v,4)
             # print('[type_info_on_hier] level {} : {} has type {}'.format(i,v,ti['type']))
         elif ti and ti['type']:
             ti = type_info(view,ti['type'],region)
@@ -171,16 +180,22 @@ class VhdlOnLoadEventListener(sublime_plugin.EventListener):
 ############################################################################
 # Display type of the signal/variable under the cursor into the status bar #
 
+# Hover requests: only the most recent one is resolved, older ones are dropped
+hover_req = {'id': 0}
+# Popup content memoized per view: {view_id: {'cc': change_count, 'res': {(a,b): (html, word)}}}
+hover_cache = {}
+
 # Event onHover to display the popup
 class VhdlShowTypeHover(sublime_plugin.EventListener):
     def on_hover(self, view, point, hover_zone):
         # Popup only on text
         if hover_zone != sublime.HOVER_TEXT:
             return
-        # Check file size to optionnaly disable the feature (finding the information can be quite long)
+        # Check file size to optionnaly restrict the popup to local information (0 disables the feature)
         threshold = view.settings().get('vhdl.hover_max_size',-1)
-        if view.size() > threshold and threshold!=-1 :
+        if threshold==0 :
             return
+        local_only = view.size() > threshold and threshold!=-1
         # Only show a popup for vhdl, when not in a string of a comment
         scope = view.scope_name(point)
         if 'source.vhdl' not in scope:
@@ -188,13 +203,120 @@ class VhdlShowTypeHover(sublime_plugin.EventListener):
         if any(w in scope for w in ['comment', 'string', 'keyword']):
             return
         popup = VhdlTypePopup(view)
-        sublime.set_timeout_async(lambda r=view.word(point), p=point: popup.show(r,p))
+        region = view.word(point)
+        hover_req['id'] += 1
+        req = hover_req['id']
+        # Already resolved for this version of the buffer: display immediately
+        res = popup.get_cached(region)
+        if res is not None:
+            popup.display(res,point)
+            return
+        # Debounce: the request is resolved only if no other hover happened in the meantime
+        delay = view.settings().get('vhdl.hover_delay',100)
+        sublime.set_timeout_async(lambda r=region, p=point: popup.show(r,p,req,local_only), delay)
+
+    def on_close(self, view):
+        hover_cache.pop(view.id(),None)
+
+# Signature help: show the signatures of a function/procedure when opening the parenthesis of a call
+class VhdlSignatureHelp(sublime_plugin.EventListener):
+    def on_modified_async(self, view):
+        if not view.settings().get('vhdl.signature_help',True):
+            return
+        sel = view.sel()
+        if len(sel)!=1 or not sel[0].empty():
+            return
+        p = sel[0].b
+        if p<2 or view.substr(p-1) != '(' or not view.match_selector(p-1,'source.vhdl - comment - string'):
+            return
+        r = view.word(p-2 if view.substr(p-2).strip() else view.find_by_class(p-1,False,sublime.CLASS_WORD_END)-1)
+        name = view.substr(r)
+        if not re.match(r'^[A-Za-z]\w*$',name) or view.match_selector(r.a,'keyword'):
+            return
+        sigs = vhdl_index.get_signatures(view,name)
+        if not sigs:
+            return
+        popup = VhdlTypePopup(view)
+        s = '<br>'.join([popup.color_str(vhdl_util.format_signature(sig)) for _,sig in sigs])
+        view.show_popup(popup.wrap_content(s),location=p,flags=tooltip_flag,max_width=500)
 
 class VhdlTypePopup :
     def __init__(self,view):
         self.view = view
 
-    def show(self,region,location):
+    def get_cached(self,region):
+        c = hover_cache.get(self.view.id())
+        if not c or c['cc'] != self.view.change_count():
+            return None
+        return c['res'].get((region.a,region.b))
+
+    def set_cached(self,key,cc,res):
+        c = hover_cache.get(self.view.id())
+        if not c or c['cc'] != cc:
+            c = {'cc': cc, 'res': {}}
+            hover_cache[self.view.id()] = c
+        c['res'][key] = res
+
+    def is_stale(self,req):
+        return req is not None and req != hover_req['id']
+
+    def show(self,region,location,req=None,local_only=False):
+        # Drop request superseded by a more recent hover
+        if self.is_stale(req):
+            return
+        key = (region.a,region.b)
+        cc = self.view.change_count()
+        # Content is resolved in stages: whatever is available when the time budget expires
+        # is displayed (or the first stage with content completed after it), and the popup
+        # is then updated each time a new stage completes
+        state = {'res': None, 'shown': False, 'done': False, 'expired': False}
+        lock = threading.Lock()
+        def on_budget():
+            with lock:
+                state['expired'] = True
+                res = state['res']
+                if state['done'] or state['shown'] or not res or not res[0]:
+                    return
+                state['shown'] = True
+            if not self.is_stale(req):
+                self.display(res,location)
+        budget = self.view.settings().get('vhdl.hover_time_budget',200)
+        sublime.set_timeout(on_budget, budget)
+        res = None
+        for res in self.get_popup_content(sublime.Region(region.a,region.b),local_only):
+            if self.is_stale(req) or self.view.change_count() != cc:
+                with lock:
+                    state['done'] = True
+                return
+            with lock:
+                state['res'] = res
+                shown = state['shown']
+                show_now = state['expired'] and not shown and res[0]
+                if show_now:
+                    state['shown'] = True
+            if show_now:
+                self.display(res,location)
+            elif shown and self.view.is_popup_visible():
+                self.view.update_popup(res[0])
+        with lock:
+            state['done'] = True
+            shown = state['shown']
+        self.set_cached(key,cc,res)
+        if shown:
+            if self.view.is_popup_visible():
+                self.view.update_popup(res[0])
+        else:
+            self.display(res,location)
+
+    def display(self,res,location):
+        s,v = res
+        if not s:
+            sublime.status_message('No definition found for ' + v)
+        else :
+            self.view.show_popup(s,location=location, flags=tooltip_flag, max_width=500, on_navigate=self.on_navigate)
+
+    # Generator of the popup content, yielding (html, word) each time more information is available
+    def get_popup_content(self,region,local_only=False):
         # If nothing is selected expand selection to word
         if region.empty() :
             region = self.view.word(region)
@@ -223,36 +345,41 @@ class VhdlTypePopup :
         #
         s,ti = self.get_type(v,region)
         if not s:
-            sublime.status_message('No definition found for ' + v)
-        else :
-            ref_name = ''
-            s = self.color_str(s,True,ti)
-            if ti and ti['type'] in ['entity', 'component']:
-                ref_name = ti['name']
-            # Records: add field definition
-            if ti['type'] and ti['tag']:
-                type_base= ti['type'].split('(')[0].lower()
-                if ti['tag'] in ['signal','port'] and type_base not in default_type:
-                    tti = type_info(self.view,ti['type'],region)
-                    if tti and tti['type'] == 'record' :
-                        fti = vhdl_util.get_all_type_info_from_record(tti['decl'])
-                        template='<br><span class="extra-info">{0}{1}</span>'
-                        for f in fti:
-                            x = self.color_str(f['decl'])
-                            s += template.format('&nbsp;'*4,x)
-            # Add reference list
-            if show_ref and ref_name :
-                refs = self.view.window().lookup_references_in_index(ref_name)
-                if refs:
-                    ref_links = []
-                    for l in refs :
-                        l_href = '{}:{}:{}'.format(l[0],l[2][0],l[2][1])
-                        l_name = os.path.basename(l[0])
-                        ref_links.append('<a href="LINK@{}" class="ref_links">{}</a>'.format(l_href,l_name))
-                    s += '<h1><br>Reference:</h1><span>{}</span>'.format('<br>'.join(ref_links))
-            # Create popup
-            s = '<style>{css}</style><div class="content">{txt}</div>'.format(css=tooltip_css, txt=s)
-            self.view.show_popup(s,location=location, flags=tooltip_flag, max_width=500, on_navigate=self.on_navigate)
+            yield '',v
+            return
+        s = self.color_str(s,True,ti)
+        yield self.wrap_content(s),v
+        if local_only:
+            return
+        ref_name = ''
+        if ti and ti['type'] in ['entity', 'component']:
+            ref_name = ti['name']
+        # Records: add field definition
+        if ti['type'] and ti['tag']:
+            type_base= ti['type'].split('(')[0].lower()
+            if ti['tag'] in ['signal','port'] and type_base not in default_type:
+                tti = type_info(self.view,ti['type'],region)
+                if tti and tti['type'] == 'record' :
+                    fti = vhdl_util.get_all_type_info_from_record(tti['decl'])
+                    template='<br><span class="extra-info">{0}{1}</span>'
+                    for f in fti:
+                        x = self.color_str(f['decl'])
+                        s += template.format('&nbsp;'*4,x)
+                    yield self.wrap_content(s),v
+        # Add reference list
+        if show_ref and ref_name :
+            refs = self.view.window().lookup_references_in_index(ref_name)
+            if refs:
+                ref_links = []
+                for l in refs :
+                    l_href = '{}:{}:{}'.format(l[0],l[2][0],l[2][1])
+                    l_name = os.path.basename(l[0])
+                    ref_links.append('<a href="LINK@{}" class="ref_links">{}</a>'.format(l_href,l_name))
+                s += '<h1><br>Reference:</h1><span>{}</span>'.format('<br>'.join(ref_links))
+                yield self.wrap_content(s),v
+
+    def wrap_content(self,s):
+        return '<style>{css}</style><div class="content">{txt}</div>'.format(css=tooltip_css, txt=s)
 
     def get_type(self,var_name,region):
         scope = self.view.scope_name(region.b-1)
@@ -295,10 +422,23 @@ class VhdlTypePopup :
                 txt = ti['decl']
         else :
             # lookup for a signal/variable declaration in current file
-            lines = self.view.substr(sublime.Region(0, self.view.line(region).b))
-            ti = vhdl_util.get_type_info(lines,var_name,4)
-            if ti:
+            ti = vhdl_util.get_type_info_from_index(vhdl_index.get_view_index(self.view),var_name,4)
+            if ti['type']:
                 txt = ti['decl']
+            else :
+                # Function/procedure: show all overloads
+                sigs = vhdl_index.get_signatures(self.view,var_name)
+                if sigs:
+                    fname,sig = sigs[0]
+                    if fname:
+                        row = sig['line']
+                    else :
+                        fname = self.view.file_name()
+                        row = self.view.rowcol(sig['pos'])[0]+1
+                    txt = '<br>'.join([vhdl_util.format_signature(x[1]) for x in sigs])
+                    ti = {'decl': txt, 'type': sig['kind'], 'name': sig['name'], 'tag': 'subprogram', 'value': None}
+                    if fname:
+                        ti['fname'] = (fname,row,1)
         return txt,ti
 
     def color_str(self,s, addLink=False, ti_var=None):
@@ -328,7 +468,7 @@ class VhdlTypePopup :
                 link = 'LINK@{}:{}:{}'.format(ti_var['fname'][0],ti_var['fname'][1],ti_var['fname'][2])
         for i,w in enumerate(words):
             # Check for keyword
-            if w.lower() in ['signal','variable','constant','port', 'type', 'is','end', 'record','array','downto','to','of','in','out','inout','entity','component','alias']:
+            if w.lower() in ['signal','variable','constant','port', 'type', 'is','end', 'record','array','downto','to','of','in','out','inout','entity','component','alias','function','procedure','return']:
                 sh+='<span class="keyword">{0}</span>'.format(w)
             elif w in [':','-','+','=']:
                 sh+='<span class="operator">{0}</span>'.format(w)
@@ -399,7 +539,8 @@ class VhdlShowHierarchyCommand(sublime_plugin.TextCommand):
             print('[VHDL.navigation] No hierarchy found !')
             return
         sublime.status_message("Show Hierarchy can take some time, please wait ...")
-        sublime.set_timeout_async(lambda inst_l=inst_l, w=self.view.window(), mname=mname : self.showHierarchy(w,inst_l,mname))
+        # Run on its own thread: the refresh of the project index waits for the end of the scan
+        threading.Thread(target=self.showHierarchy, args=(self.view.window(),inst_l,mname), daemon=True).start()
 
     def showHierarchy(self,w,inst_l,mname):
         # Save info in global for later access
@@ -408,38 +549,18 @@ class VhdlShowHierarchyCommand(sublime_plugin.TextCommand):
         hierarchyInfo['view'] = self.view
         hierarchyInfo['fname'] = self.view.file_name()
         hierarchyInfo['name'] = mname
-        # Create Dictionnary where each type is associated with a list of tuple (instance type, instance name)
-        self.d = {}
-        self.d[mname] = inst_l
-        self.unresolved = []
-        self.component = []
-        li = list(set(inst_l))
-        while li:
-            li_next = []
-            for i in li:
-                inst_type = i[1]
-                if inst_type not in hierarchyInfo['dict'].keys() and inst_type not in self.component:
-                    filelist = w.lookup_symbol_in_index(inst_type)
-                    filelist = list(set([f[0] for f in filelist]))
-                    # print('Symbol {} defined in {}'.format(inst_type,[x[0] for x in filelist]))
-                    i_il = []
-                    if filelist:
-                        for f in filelist:
-                            fname = sublime_util.normalize_fname(f)
-                            i_il = vhdl_util.get_inst_list_from_file(fname,inst_type)
-                            if i_il is not None:
-                                hierarchyInfo['dict'][inst_type] = fname
-                                break
-                    else :
-                        self.unresolved.append(inst_type)
-                    if i_il:
-                        li_next += i_il
-                        self.d[inst_type] = i_il
-                    elif i_il is None :
-                        self.component.append(inst_type)
-            li = list(set(li_next))
+        # Instances of each entity are retrieved from the design graph of the project index
+        hierarchyInfo['proj'] = vhdl_index.window_key(w)
+        vhdl_module.VhdlModuleInstCommand.get_list_file(None,hierarchyInfo['proj'],None)
+        # Dictionnary where each type is associated with a list of tuple (instance name, instance type)
+        hierarchyInfo['inst'] = {mname: inst_l}
+        hierarchyInfo['unresolved'] = set()
+        hierarchyInfo['component'] = set()
+        hierarchyInfo['expand'] = {}
+        # Only the first levels are displayed: deeper levels are expanded on demand
+        max_lvl = self.view.settings().get('vhdl.hierarchy_max_lvl',4)
         txt = mname + '\n'
-        txt += self.printSubmodule(mname,1)
+        txt += ''.join(hierarchy_lines(mname,1,max_lvl))
 
         # Check if we open the result in a new window
         if self.view.settings().get('vhdl.hierarchy_new_window',False):
@@ -453,28 +574,156 @@ class VhdlShowHierarchyCommand(sublime_plugin.TextCommand):
         v.set_scratch(True)
         v.run_command('insert_snippet',{'contents':str(txt)})
 
-    def printSubmodule(self,name,lvl):
-        txt = ''
-        if name in self.d:
-            # print('printSubmodule ' + str(self.d[name]))
-            for x in self.d[name]:
-                txt += '  '*lvl
-                if x[1] in self.d :
-                    txt += '+ {name}    ({type})\n'.format(name=x[0],type=x[1])
-                    if lvl<32 :
-                        txt += self.printSubmodule(x[1],lvl+1)
-                    else :
-                        print('[VHDL.navigation] Hierarchy with more than 20 level not supported !')
-                        return
-                else:
-                    if x[1] in self.unresolved:
-                        comment = '  [U]'
-                    elif x[1] in self.component:
-                        comment = '  [C]'
-                    else:
-                        comment = ''
-                    txt += '- {name}    ({type}){comment}\n'.format(name=x[0],type=x[1],comment=comment)
-        return txt
+# Return the list of instances of an entity (None for a component or unknown entity)
+def hierarchy_children(inst_type):
+    global hierarchyInfo
+    d = hierarchyInfo['inst']
+    if inst_type not in d:
+        fname,i_il = lookup_submodules(hierarchyInfo['view'],hierarchyInfo['proj'],inst_type)
+        if fname:
+            hierarchyInfo['dict'][inst_type] = fname
+        elif not lookup_declared(hierarchyInfo['view'],hierarchyInfo['proj'],inst_type):
+            hierarchyInfo['unresolved'].add(inst_type)
+        else:
+            hierarchyInfo['component'].add(inst_type)
+        d[inst_type] = i_il
+    return d[inst_type]
+
+# Return the lines describing the hierarchy below an entity, starting at indentation lvl
+# Only nb_lvl levels are elaborated (all if negative): deeper instances are marked with [...]
+def hierarchy_lines(name,lvl,nb_lvl):
+    lines = []
+    stack = [(x,lvl) for x in reversed(hierarchy_children(name) or [])]
+    while stack:
+        x,l = stack.pop()
+        il = hierarchy_children(x[1])
+        if il:
+            # Always stop at 32 level to avoid infinite loop on recursive instantiation
+            if (nb_lvl>=0 and l-lvl+1>=nb_lvl) or l-lvl>=32:
+                lines.append('{}+ {name}    ({type})  [...]\n'.format('  '*l,name=x[0],type=x[1]))
+            else :
+                lines.append('{}+ {name}    ({type})\n'.format('  '*l,name=x[0],type=x[1]))
+                stack += [(y,l+1) for y in reversed(il)]
+        else:
+            if x[1] in hierarchyInfo['unresolved']:
+                comment = '  [U]'
+            elif x[1] in hierarchyInfo['component']:
+                comment = '  [C]'
+            else:
+                comment = ''
+            lines.append('{}- {name}    ({type}){comment}\n'.format('  '*l,name=x[0],type=x[1],comment=comment))
+    return lines
+
+# Expand the collapsed instances ([...]) on the selected lines of the hierarchy
+class VhdlHierarchyExpandCommand(sublime_plugin.TextCommand):
+
+    def run(self,edit):
+        global hierarchyInfo
+        if 'expand' not in hierarchyInfo:
+            return
+        max_lvl = self.view.settings().get('vhdl.hierarchy_max_lvl',4)
+        # Process from the end to keep the position of other selections valid
+        for r in reversed(list(self.view.sel())):
+            r = self.view.line(r)
+            m = re.match(r'^( *)\+ \w+\s+\((\w+)\)(\s+\[\.\.\.\])$',self.view.substr(r))
+            if not m:
+                continue
+            lvl = len(m.group(1))//2+1
+            # Cache expansion result: re-expanding the same type at the same level is free
+            key = (m.group(2),lvl)
+            if key not in hierarchyInfo['expand']:
+                hierarchyInfo['expand'][key] = ''.join(hierarchy_lines(m.group(2),lvl,max_lvl))
+            self.view.insert(edit, r.b+1, hierarchyInfo['expand'][key])
+            self.view.erase(edit, sublime.Region(r.b-len(m.group(3)),r.b))
+
+    def is_enabled(self):
+        return 'text.result-vhdl' in self.view.scope_name(0)
+
+
+###############################################################
+# Export the hierarchy of current module with instance counts #
+class VhdlExportHierarchyCommand(sublime_plugin.TextCommand):
+
+    def run(self,edit,fmt='json'):
+        mname = getModuleName(self.view)
+        if not mname:
+            print('[VHDL.navigation] No entity/architecture found !')
+            return
+        txt = self.view.substr(sublime.Region(0, self.view.size()))
+        inst_l = vhdl_util.get_inst_list(txt,mname)
+        if not inst_l:
+            print('[VHDL.navigation] No hierarchy found !')
+            return
+        self.fmt = fmt
+        fname = self.view.file_name()
+        dname = os.path.dirname(fname) if fname else os.path.expanduser('~')
+        default = os.path.join(dname,'{}_hierarchy.{}'.format(mname,fmt))
+        w = self.view.window()
+        w.show_input_panel('Export hierarchy to', default, lambda x, w=w, inst_l=inst_l, mname=mname: threading.Thread(target=self.export, args=(w,x,inst_l,mname), daemon=True).start(), None, None)
+
+    def export(self,w,fname,inst_l,mname):
+        sublime.status_message("Exporting hierarchy of {} ...".format(mname))
+        proj = vhdl_index.window_key(w)
+        vhdl_module.VhdlModuleInstCommand.get_list_file(None,proj,None)
+        subs = {mname.lower(): (self.view.file_name(),inst_l)}
+        def submodules(t):
+            if t.lower() not in subs:
+                subs[t.lower()] = lookup_submodules(self.view,proj,t)
+            return subs[t.lower()]
+        stats = vhdl_index.get_hierarchy_stats(mname,lambda t: submodules(t)[1])
+        info = {}
+        for name in stats['order']:
+            fn = submodules(stats['name'][name])[0]
+            if fn:
+                status = ''
+            elif lookup_declared(self.view,proj,stats['name'][name]):
+                status = 'component'
+            else :
+                status = 'unresolved'
+            info[name] = {'file': fn or '', 'status': status, 'count': stats['count'][name], 'size': stats['size'][name]}
+        try:
+            with open(fname,'w') as f:
+                if self.fmt == 'dot':
+                    self.write_dot(f,stats,info)
+                elif self.fmt == 'csv':
+                    self.write_csv(f,stats,info)
+                else :
+                    self.write_json(f,stats,info)
+        except OSError as e:
+            sublime.status_message('[VHDL] Unable to export hierarchy: {}'.format(e))
+            return
+        sublime.status_message('Hierarchy of {} exported to {} ({} instances)'.format(mname,fname,stats['size'][stats['top']]))
+        w.open_file(fname)
+
+    def write_json(self,f,stats,info):
+        names = stats['name']
+        d = {'top': names[stats['top']], 'instances': stats['size'][stats['top']], 'entities': {}}
+        for name in reversed(stats['order']):
+            e = dict(info[name])
+            e['instances'] = [{'name':x[0], 'type':x[1]} for x in stats['nodes'][name]]
+            d['entities'][names[name]] = e
+        if stats['loops']:
+            d['recursive'] = [[names[x] for x in l] for l in stats['loops']]
+        json.dump(d,f,indent=2)
+
+    def write_csv(self,f,stats,info):
+        w = csv.writer(f,lineterminator='\n')
+        w.writerow(['entity','count','subtree_size','nb_instances','status','file'])
+        for name in reversed(stats['order']):
+            w.writerow([stats['name'][name],info[name]['count'],info[name]['size'],len(stats['nodes'][name]),info[name]['status'],info[name]['file']])
+
+    def write_dot(self,f,stats,info):
+        names = stats['name']
+        f.write('digraph "{}" {{\n'.format(names[stats['top']]))
+        f.write('  node [shape=box];\n')
+        for name in reversed(stats['order']):
+            style = '' if not info[name]['status'] else ', style=dashed'
+            f.write('  "{0}" [label="{0}\\ncount={1}\\nsize={2}"{3}];\n'.format(names[name],info[name]['count'],info[name]['size'],style))
+        for name in reversed(stats['order']):
+            for t,n in sorted(Counter([x[1].lower() for x in stats['nodes'][name]]).items()):
+                label = '' if n==1 else ' [label="x{}"]'.format(n)
+                f.write('  "{}" -> "{}"{};\n'.format(names[name],names[t],label))
+        f.write('}\n')
 
 
 # Navigate within the hierarchy
@@ -562,28 +811,17 @@ class VhdlFindInstanceCommand(sublime_plugin.TextCommand):
     def run(self,edit):
         mname = getModuleName(self.view)
         sublime.status_message("Find Instance can take some time, please wait ...")
-        sublime.set_timeout_async(lambda x=mname: self.findInstance(x))
+        threading.Thread(target=self.findInstance, args=(mname,), daemon=True).start()
 
     def findInstance(self, mname):
-        projname = sublime.active_window().project_file_name()
-        if projname not in vhdl_module.list_module_files:
-            vhdl_module.VhdlModuleInstCommand.get_list_file(None,projname,None)
+        proj = vhdl_index.window_key(sublime.active_window())
+        # Refresh the project index: only files changed since last scan are parsed
+        vhdl_module.VhdlModuleInstCommand.get_list_file(None,proj,None)
         inst_dict = {}
         cnt = 0
-        re_str = r'(?si)^\s*(\w+)\s*:\s*(?:use\s+)?(?:entity\s+)?(\w+\.)?{}(\s*\(\s*\w+\s*\))?\s+(port|generic)'.format(mname)
-        p = re.compile(re_str,re.MULTILINE)
-        for fn in vhdl_module.list_module_files[projname]:
-            with open(fn) as f:
-                txt = f.read()
-                if mname in txt:
-                    for m in re.finditer(p,txt):
-                        cnt+=1
-                        lineno = txt.count("\n",0,m.start()+1)+1
-                        res = (m.groups()[0].strip(),lineno)
-                        if fn not in inst_dict:
-                            inst_dict[fn] = [res]
-                        else:
-                            inst_dict[fn].append(res)
+        for fn,il in sorted(vhdl_index.find_instances(proj, mname).items()):
+            inst_dict[fn] = [(x[0],x[1]) for x in sorted(il, key=lambda x: x[1])]
+            cnt += len(il)
         if inst_dict:
             v = sublime.active_window().new_file()
             v.set_name(mname + ' Instances')
@@ -649,29 +887,18 @@ class VhdlShowNavbarCommand(sublime_plugin.TextCommand):
         t,name = getObjName(self.view)
         if not name:
             return
-        txt = self.view.substr(sublime.Region(0, self.view.size()))
+        # Nothing to do if the navbar already displays this version of the module
+        key = (self.view.buffer_id(), self.view.change_count(), t, name)
+        wid = self.view.window().id()
+        if wid in navBar and navBar[wid].get('key') == key:
+            nv = navBar[wid]['view']
+            if nv.is_valid() and 'vhdl' in nv.scope_name(0):
+                return
+        info = vhdl_util.get_outline_module(vhdl_index.get_view_outline(self.view), t, name)
+
+        sublime.set_timeout_async(lambda info=info, w=self.view.window(), key=key: self.showHierarchy(info,w,key))
 
-        info = {
-            'type': t, 'name': name, 'port': {},
-            'signal': {}, 'alias': {}, 'const': {},
-            'inst': [], 'proc':{}, 'func':{}};
-        x = vhdl_util.get_ports(txt,name);
-        if x and 'port' in x:
-            info['port'] = x['port']
-        info['inst'] = vhdl_util.get_inst_list(txt,name);
-        x = vhdl_util.get_signals(txt,name);
-        if x :
-            for t in ['signal', 'const', 'alias'] :
-                if t in x:
-                    info[t] = x[t]
-        txt = vhdl_util.clean_comment(txt)
-        info['func'] = vhdl_util.get_function_list(txt, name, True);
-        info['proc'] = vhdl_util.get_procedure_list(txt, name, True);
-        info['process'] = vhdl_util.get_process_list(txt, name, True);
-
-        sublime.set_timeout_async(lambda info=info, w=self.view.window(): self.showHierarchy(info,w))
-
-    def showHierarchy(self,mi,w):
+    def showHierarchy(self,mi,w,key=None):
         # Save info in global for later access
         info = {'dict':{}, 'view':None,'fname':''}
         info['view'] = self.view
@@ -711,8 +938,6 @@ class VhdlShowNavbarCommand(sublime_plugin.TextCommand):
                 group_id = len(l['cells'])-1
                 w.focus_group(group_id)
                 navBarView = w.active_view_in_group(group_id)
-                navBarView.run_command("select_all")
-                navBarView.run_command("right_delete")
             navBarView.set_scratch(True)
             navBar[wid] = {'view':navBarView, 'settings':{}, 'sv_on': False}
             navBar[wid]['settings']['update'] = 1
@@ -722,98 +947,123 @@ class VhdlShowNavbarCommand(sublime_plugin.TextCommand):
             navBar[wid]['settings']['show_alias'] = self.view.settings().get('vhdl.navbar_show_alias',False)
             navBar[wid]['settings']['show_const'] = self.view.settings().get('vhdl.navbar_show_const',False)
             navBar[wid]['settings']['font_size'] = self.view.settings().get('vhdl.navbar_font_size',10)
-        else :
-            navBar[wid]['view'].run_command("select_all")
-            navBar[wid]['view'].run_command("right_delete")
+            navBar[wid]['settings']['page_size'] = self.view.settings().get('vhdl.navbar_page_size',200)
 
         if 'vhdl' not in navBar[wid]['view'].scope_name(0):
             navBar[wid]['view'].set_syntax_file('Packages/Smart VHDL/navbar.sublime-syntax')
         w.settings().set('navbar-hdl-shared', navbar_flag | 2)
 
         navBar[wid]['info'] = info
-        navBar[wid]['childless'] = []
+        navBar[wid]['key'] = key
+        navBar[wid]['childless'] = set()
 
         # Create content
         top_level = mi['name']
-        txt = '{}\n'.format(top_level)
-        txt += '-'*len(top_level) + '\n'
-        txt += self.printContent(1,mi,navBar[wid])
+        content = [('{}'.format(top_level), NavbarNode('title',top_level)), ('-'*len(top_level), NavbarNode('title'))]
+        content += self.printContent(1,mi,navBar[wid])
+        txt = ''.join([l+'\n' for l,_ in content])
 
-        navBar[wid]['view'].set_name(top_level + ' Hierarchy')
-        navBar[wid]['view'].run_command('insert_snippet',{'contents': '$x', 'x':txt})
+        # Only modified lines are updated when the navbar already displays the same module
+        nv = navBar[wid]['view']
+        is_new = nv.name() != top_level + ' Hierarchy'
+        nv.set_name(top_level + ' Hierarchy')
+        nv.run_command('vhdl_navbar_replace',{'txt':txt, 'fold': not is_new})
 
         # Add phantoms
+        navbar_model_reset(navBar[wid], [n for _,n in content])
         self.build_phantoms(wid)
 
-        # Fold functions arguments
-        navBar[wid]['view'].run_command("fold_by_level", {"level": 2})
-        # Ensure focus is at beginning of file
-        sublime_util.move_cursor(navBar[wid]['view'],0)
-
-    def printContent(self,lvl,ti, nb):
-        txt = ''
+        if is_new:
+            # Fold functions arguments
+            nv.run_command("fold_by_level", {"level": 2})
+            # Ensure focus is at beginning of file
+            sublime_util.move_cursor(nv,0)
+
+    # Content of the navbar: list of (line, node)
+    # Sections with more items than the page size are only materialized on demand,
+    # one page at a time (cf page_content)
+    def printContent(self,lvl,ti, nb, parent=None):
+        content = []
+        settings = nb['settings']
+        def section(title, items, render):
+            sec = NavbarNode('section',title,'',None,lvl-1)
+            sec.items = items
+            sec.render = render
+            content.append(('{}{}: {}'.format('  '*(lvl-1),title,len(items)), sec))
+            page = settings.get('page_size',0)
+            if page > 0 and len(items) > page:
+                sec.state = 'expand'
+            else :
+                sec.state = ''
+                content.extend(self.page_content(nb,sec,True))
+        def item(line,kind,name,type='',indent=lvl,p=None):
+            return [(line,NavbarNode(kind,name,type,p,indent))]
         # print(ti)
-        if 'port' in ti and ti['port'] and (nb['settings']['show_port'] and lvl==1):
-            txt += '{}Ports:\n'.format('  '*(lvl-1))
-            name_len = max([len(x['name']) for x in ti['port']])
-            for p in ti['port'] :
-                d = self.get_dir_symb(p)
-                txt += '{indent}* {dir} {name:<{l}} : {type}\n'.format(indent='  '*lvl,dir=d,name=p['name'],type=p['type'],l=name_len)
-        if 'const' in ti and ti['const'] and (nb['settings']['show_const'] and lvl==1):
-            txt += 'Constants:\n'
-            name_len = max([len(x['name']) for x in ti['const']])
-            for p in ti['const'] :
-                txt += '{indent}* {name:<{l}} : {type} := {value}\n'.format(indent='  '*lvl,name=p['name'],type=p['type'],value=p['value'],l=name_len)
-        if 'signal' in ti and ti['signal'] and (nb['settings']['show_signal'] and lvl==1):
-            txt += 'Signals:\n'
-            name_len = max([len(x['name']) for x in ti['signal']])
-            for p in ti['signal'] :
-                txt += '{indent}* {name:<{l}} : {type}\n'.format(indent='  '*lvl,name=p['name'],type=p['type'],l=name_len)
-        if 'alias' in ti and ti['alias'] and (nb['settings']['show_alias'] and lvl==1):
-            txt += 'Alias:\n'
-            name_len = max([len(x['name']) for x in ti['alias']])
-            for p in ti['alias'] :
+        if 'port' in ti and ti['port'] and (settings['show_port'] and lvl==1):
+            port_len = max([len(x['name']) for x in ti['port']])
+            section('Ports', ti['port'], lambda p: item('{indent}* {dir} {name:<{l}} : {type}'.format(indent='  '*lvl,dir=self.get_dir_symb(p),name=p['name'],type=p['type'],l=port_len),'port',p['name'],p['type']))
+        if 'const' in ti and ti['const'] and (settings['show_const'] and lvl==1):
+            const_len = max([len(x['name']) for x in ti['const']])
+            section('Constants', ti['const'], lambda p: item('{indent}* {name:<{l}} : {type} := {value}'.format(indent='  '*lvl,name=p['name'],type=p['type'],value=p['value'],l=const_len),'const',p['name'],p['type']))
+        if 'signal' in ti and ti['signal'] and (settings['show_signal'] and lvl==1):
+            signal_len = max([len(x['name']) for x in ti['signal']])
+            section('Signals', ti['signal'], lambda p: item('{indent}* {name:<{l}} : {type}'.format(indent='  '*lvl,name=p['name'],type=p['type'],l=signal_len),'signal',p['name'],p['type']))
+        if 'alias' in ti and ti['alias'] and (settings['show_alias'] and lvl==1):
+            alias_len = max([len(x['name']) for x in ti['alias']])
+            def alias_line(p):
                 if 'type' in p and p['type']!='alias':
-                    txt += '{indent}* {name:<{l}} : {type} := {value}\n'.format(indent='  '*lvl,name=p['name'],type=p['type'],value=p['value'],l=name_len)
-                else :
-                    txt += '{indent}* {name:<{l}} : {value}\n'.format(indent='  '*lvl,name=p['name'],value=p['value'],l=name_len)
+                    return item('{indent}* {name:<{l}} : {type} := {value}'.format(indent='  '*lvl,name=p['name'],type=p['type'],value=p['value'],l=alias_len),'alias',p['name'],p['type'])
+                return item('{indent}* {name:<{l}} : {value}'.format(indent='  '*lvl,name=p['name'],value=p['value'],l=alias_len),'alias',p['name'])
+            section('Alias', ti['alias'], alias_line)
         if 'inst' in ti and ti['inst']:
-            if lvl==1 and (nb['settings']['show_port'] or nb['settings']['show_signal']):
-                txt += '{}Instances:\n'.format('  '*(lvl-1))
+            # Without other sections the instances are listed directly, unless there is
+            # more than a page of them (e.g. a netlist): they are then paged like any section
+            page = settings.get('page_size',0)
+            if (lvl==1 and (settings['show_port'] or settings['show_signal'])) or (page > 0 and len(ti['inst']) > page):
+                section('Instances', ti['inst'], lambda x: [self.inst_line(nb,x,lvl,None)])
             else :
-                lvl -= 1
-            for inst in ti['inst']:
-                if inst[1] in nb['childless']:
-                    symb = u'\u180E'
-                else :
-                    symb = ''
-                txt += '{}{}{name} ({type})\n'.format('  '*lvl,symb,name=inst[0],type=inst[1])
+                for x in ti['inst']:
+                    content.append(self.inst_line(nb,x,lvl-1,None))
+        def subprogram(kind,n,v):
+            l = item('{}{name}'.format('  '*lvl,name=n),kind,n,v.get('return') or '')
+            if v['args'] :
+                name_len = max([len(x['name']) for x in v['args']])
+                for p in v['args'] :
+                    d = self.get_dir_symb(p)
+                    l += item('{indent}* {dir} {name:<{l}} : {type}'.format(indent='  '*(lvl+1),dir=d,name=p['name'],type=p['type'],l=name_len),'arg',p['name'],p['type'],lvl+1,l[0][1])
+            return l
         if 'proc' in ti and ti['proc'] :
-            txt += '{}Procedures:\n'.format( '  '*(lvl-1))
-            for n,v in ti['proc'].items():
-                txt += '  '*lvl
-                txt += '{name}\n'.format(name=n)
-                if v['args'] :
-                    name_len = max([len(x['name']) for x in v['args']])
-                    for p in v['args'] :
-                        d = self.get_dir_symb(p)
-                        txt += '{indent}* {dir} {name:<{l}} : {type}\n'.format(indent='  '*(lvl+1),dir=d,name=p['name'],type=p['type'],l=name_len)
+            section('Procedures', list(ti['proc'].values()), lambda x: subprogram('proc',x['name'],x))
         if 'func' in ti and ti['func'] :
-            txt += '{}Functions:\n'.format( '  '*(lvl-1))
-            for n,v in ti['func'].items():
-                txt += '  '*lvl
-                txt += '{name}\n'.format(name=n)
-                if v['args'] :
-                    name_len = max([len(x['name']) for x in v['args']])
-                    for p in v['args'] :
-                        d = self.get_dir_symb(p)
-                        txt += '{indent}* {dir} {name:<{l}} : {type}\n'.format(indent='  '*(lvl+1),dir=d,name=p['name'],type=p['type'],l=name_len)
-        if 'process' in ti and ti['process'] and nb['settings']['show_process']:
-            txt += '{}Process:\n'.format( '  '*(lvl-1))
-            for n in ti['process']:
-                txt += '  '*lvl
-                txt += '* {name}\n'.format(name=n)
-        return txt
+            section('Functions', list(ti['func'].values()), lambda x: subprogram('func',x['name'],x))
+        if 'process' in ti and ti['process'] and settings['show_process']:
+            section('Process', ti['process'], lambda n: item('{}* {name}'.format('  '*lvl,name=n),'process',n))
+        return content
+
+    # Line of an instance
+    def inst_line(self, nb, inst, indent, parent):
+        leaf = inst[1].lower() in nb['childless']
+        symb = u'\u180E' if leaf else ''
+        n = NavbarNode('inst',inst[0],inst[1],parent,indent)
+        if leaf:
+            n.state = 'leaf'
+            n.marker = True
+        return ('{}{}{name} ({type})'.format('  '*indent,symb,name=inst[0],type=inst[1]),n)
+
+    # Content of the next page of items of a section or an expanded instance, followed
+    # by a row to load the following page when some items are still not displayed
+    def page_content(self, nb, owner, all=False):
+        page = nb['settings'].get('page_size',0)
+        start = owner.shown
+        end = len(owner.items) if all or page <= 0 else min(len(owner.items), start+page)
+        content = []
+        for x in owner.items[start:end]:
+            content += owner.render(x)
+        owner.shown = end
+        if end < len(owner.items):
+            n = NavbarNode('more','','',owner,owner.indent+1)
+            content.append(('{}... {} more'.format('  '*n.indent,len(owner.items)-end),n))
+        return content
 
     def get_dir_symb(self, ti):
         if 'tag' in ti and ti['tag'] and ti['tag'].lower()=='constant' :
@@ -830,117 +1080,93 @@ class VhdlShowNavbarCommand(sublime_plugin.TextCommand):
                 d = '<->'
         return d
 
+    # Phantoms: one per instance node, identified by its path so that the
+    # phantom is unchanged when lines are inserted above it and only phantoms
+    # whose state changed are rendered again.
     def build_phantoms(self,wid):
-        view = navBar[wid]['view']
-        # Clear exiting phantoms if nay
-        if 'phantomSet' in navBar[wid] :
-            navBar[wid]['view'].erase_phantoms('sv-navbar')
+        nb = navBar[wid]
+        view = nb['view']
+        # Phantom set is kept between updates: phantoms unchanged are not rendered again
+        if 'phantomSet' not in nb :
+            view.erase_phantoms('sv-navbar')
+            nb['phantomSet'] = sublime.PhantomSet(view, "sv-navbar")
+            nb['on_navigate'] = self.on_navigate
+        self.update_phantoms(wid)
+
+    def update_phantoms(self,wid):
+        nb = navBar[wid]
+        view = nb['view']
         phantoms = []
-        pid = 0
-        regions = view.find_by_selector('storage.name.type.userdefined.hierarchy-vhdl')
-        for r in regions :
-            name = view.substr(r)
-            ilc = view.indentation_level(r.a)
-            pnl = view.line(r).b+1
-            iln = view.indentation_level(pnl)
-            # print('[Phantoms] Name {} - Point {} ({}) : indent = {} vs {}, folded = {}'.format(name,pnl,view.rowcol(pnl),iln,ilc,view.is_folded(sublime.Region(pnl))))
-            # print('indent level for member {} = {} {}'.format(name,ilc,iln))
-            if name in navBar[wid]['childless'] :
-                content = '<a>-</a>'
-            elif ilc>=iln :
-                content = '<a href="type:{}:{}:{}:{}">+</a>'.format(name,r.a,ilc,pid)
-            elif view.is_folded(sublime.Region(pnl)) :
-                content = '<a href="unfold:{}:{}">+</a>'.format(r.a,pid)
+        for path,n in nb['nodes'].items():
+            if n.state == 'leaf':
+                content = '-' if n.marker else '<a>-</a>'
+            elif n.state == 'expand':
+                content = '<a href="type:{}">+</a>'.format(path)
+            elif n.state == 'unfold':
+                content = '<a href="unfold:{}">+</a>'.format(path)
             else :
-                content = '<a href="fold:{}:{}">-</a>'.format(r.a,pid)
-            r = sublime.Region(view.line(r).a + ilc*2)
+                content = '<a href="fold:{}">-</a>'.format(path)
             phantoms.append(sublime.Phantom(
-                region = r,
+                region = sublime.Region(view.text_point(n.row,n.indent*2)),
                 content=PHANTOM_TEMPLATE.format(content,colors['operator']),
                 layout=sublime.LAYOUT_INLINE,
-                on_navigate=self.on_navigate)
+                on_navigate=nb['on_navigate'])
             )
-            pid += 1
-        regions = view.find_by_selector('meta.annotation.marker')
-        for r in regions :
-            phantoms.append(sublime.Phantom(
-                region = r,
-                content=PHANTOM_TEMPLATE.format('-',colors['operator']),
-                layout=sublime.LAYOUT_INLINE)
-            )
-        if len(phantoms)>0:
-            navBar[wid]['phantomSet'] = sublime.PhantomSet(navBar[wid]['view'], "sv-navbar")
-            navBar[wid]['phantom'] = phantoms
-            navBar[wid]['phantomSet'].update(phantoms)
+        nb['phantomSet'].update(phantoms)
 
-    def change_phantom(self,wid,v,pid,content):
-        v.erase_phantoms('sv-navbar')
-        navBar[wid]['phantomSet'] = sublime.PhantomSet(v, "sv-navbar")
-        navBar[wid]['phantom'][pid].content = PHANTOM_TEMPLATE.format(content,colors['operator'])
-        navBar[wid]['phantomSet'].update(navBar[wid]['phantom'])
+    def change_phantom(self,wid,node,state):
+        node.state = state
+        self.update_phantoms(wid)
 
     def on_navigate(self,href):
         global navBar
-        href_s = href.split(':')
+        cmd,_,path = href.partition(':')
         w = sublime.active_window()
         wid = w.id()
-        view = navBar[wid]['info']['view']
-        v =  navBar[wid]['view']
-        # print('[VHDL.Navbar] on_navigate = {}'.format(href_s))
-        if href_s[0]=="type" :
-            if href_s[1] in navBar[wid]['childless'] :
-                self.change_phantom(wid,v,int(href_s[4]),'<a>-</a>')
-                return
-            ti = vhdl_module.lookup_type(view,href_s[1],2)
-            # print(ti)
-            if not ti or 'type' not in ti:
-                navBar[wid]['childless'].append(href_s[1])
-                self.change_phantom(wid,v,int(href_s[4]),'<a>-</a>')
-                # print('Type {} not found: {}'.format(href_s[1],ti))
-                return
-            if ti['type'].lower() == 'architecture' :
-                if 'fname' in ti :
-                    mi = {}
-                    mi['inst'] = vhdl_util.get_inst_list_from_file(ti['fname'][0])
-                    txt = self.printContent(2,mi,navBar[wid])
-                    if txt:
-                        r = self.insert_text_next_line(v,int(href_s[2]),txt)
-                        self.build_phantoms(wid)
-                    else :
-                        navBar[wid]['childless'].append(ti['name'])
-                        self.change_phantom(wid,v,int(href_s[4]),'<a>-</a>')
-            else :
-                # print('Unsupported Type {} not found: {}'.format(href_s[1],ti))
+        if wid not in navBar or path not in navBar[wid].get('nodes',{}):
+            return
+        nb = navBar[wid]
+        v =  nb['view']
+        node = nb['nodes'][path]
+        # print('[VHDL.Navbar] on_navigate = {} {}'.format(cmd,path))
+        if cmd=="type" :
+            # Next page of items: replace the row by the new items
+            if node.kind == 'more':
+                content = self.page_content(nb,node.parent)
+                v.run_command('vhdl_navbar_insert',{'row': node.row, 'txt': ''.join([l+'\n' for l,_ in content]), 'erase': 1})
+                navbar_model_insert(nb, node.row, [n for _,n in content], 1)
+                self.update_phantoms(wid)
                 return
-        elif href_s[0]=="fold" :
-            r_start = int(href_s[1])
-            s = sublime.Region(v.line(r_start).b+1)
+            if node.kind == 'inst':
+                if node.type.lower() in nb['childless'] :
+                    self.change_phantom(wid,node,'leaf')
+                    return
+                fname,inst_l = navbar_get_submodules(w,nb['info']['view'],node.type)
+                if not inst_l:
+                    nb['childless'].add(node.type.lower())
+                    self.change_phantom(wid,node,'leaf')
+                    return
+                node.fname = fname
+                node.items = inst_l
+                node.render = lambda x, node=node: [self.inst_line(nb,x,node.indent+1,node)]
+            content = self.page_content(nb,node)
+            v.run_command('vhdl_navbar_insert',{'row': node.row+1, 'txt': ''.join([l+'\n' for l,_ in content])})
+            navbar_model_insert(nb, node.row+1, [n for _,n in content])
+            self.change_phantom(wid,node,'fold')
+        elif cmd=="fold" :
+            s = sublime.Region(v.line(v.text_point(node.row,0)).b+1)
             s = v.indented_region(s.b)
             if not s.empty():
                 s.a -= 1
                 s.b -= 1
                 v.fold(s)
-            pid = int(href_s[2])
-            t = '<a href="unfold:{}:{}">+</a>'.format(r_start,pid)
-            self.change_phantom(wid,v,pid,t)
-        elif href_s[0]=="unfold" :
-            r_start = int(href_s[1])
-            s = sublime.Region(v.line(r_start).b+1)
+            self.change_phantom(wid,node,'unfold')
+        elif cmd=="unfold" :
+            s = sublime.Region(v.line(v.text_point(node.row,0)).b+1)
             v.unfold(s)
-            pid = int(href_s[2])
-            t = '<a href="fold:{}:{}">-</a>'.format(r_start,pid)
-            self.change_phantom(wid,v,pid,t)
+            self.change_phantom(wid,node,'fold')
             self.fold_methods(v,s)
 
-    def insert_text_next_line(self, v, r, txt):
-        r = v.line(sublime.Region(r))
-        v.sel().clear()
-        v.sel().add(r.b)
-        # Workaround weird auto-indentation behavior of insert_snippet
-        v.run_command('insert_snippet', {'contents': '\n'})
-        v.run_command('insert_snippet', {'contents': '$x', 'x':txt[:-1]})
-        return r
-
     def fold_methods(self, v, r_start) :
         folds = []
         rs = v.indented_region(r_start.b)
@@ -968,6 +1194,170 @@ class VhdlShowNavbarCommand(sublime_plugin.TextCommand):
                         folds.append(s)
         v.fold(folds)
 
+# Node of the navbar tree: one per line of the navbar
+class NavbarNode :
+    def __init__(self, kind, name='', type='', parent=None, indent=0):
+        self.kind = kind        # title, section, port, const, signal, alias, inst, proc, func, arg or process
+        self.name = name
+        self.type = type
+        self.parent = parent
+        self.indent = indent
+        self.row = 0
+        self.path = ''          # Instances: path of labels, unique in the navbar
+        self.state = 'expand'   # Instances: expand (children not loaded), fold (children displayed), unfold (children folded) or leaf
+        self.marker = False     # Instances: displayed with the childless marker
+        self.fname = ''         # Instances: file of the architecture, once expanded
+        self.items = []         # Sections/instances: items displayed one page at a time
+        self.render = None      # Sections/instances: function returning the content of an item
+        self.shown = 0          # Sections/instances: number of items displayed
+
+# Navbar model: rows is the list of nodes indexed by row, nodes the nodes with a
+# phantom (instances, paginated sections and rows to load the next page) indexed by path
+def navbar_model_reset(nb, nodes):
+    nb['rows'] = []
+    nb['nodes'] = {}
+    navbar_model_insert(nb, 0, nodes)
+
+# Insert nodes at a row, replacing the erase nodes already there
+def navbar_model_insert(nb, row, nodes, erase=0):
+    rows = nb['rows']
+    for n in rows[row:row+erase]:
+        if nb['nodes'].get(n.path) is n:
+            del nb['nodes'][n.path]
+    rows[row:row+erase] = nodes
+    for i in range(row,len(rows)):
+        rows[i].row = i
+    for n in nodes:
+        if n.kind == 'inst':
+            path = n.name if not n.parent else n.parent.path + '/' + n.name
+        elif n.kind == 'section' and n.state:
+            path = '#' + n.name
+        elif n.kind == 'more':
+            path = n.parent.path + '/...'
+        else :
+            continue
+        # Make path unique (e.g. same label in different generate)
+        k = 1
+        n.path = path
+        while n.path in nb['nodes']:
+            k += 1
+            n.path = '{}#{}'.format(path,k)
+        nb['nodes'][n.path] = n
+
+# Return the file of the architecture of an entity and its list of instances (label, type)
+# The design graph of the project index is used when already in memory: called from the
+# UI thread, the index must not be loaded from its cache file here.
+def navbar_get_submodules(w, view, name):
+    proj = vhdl_index.window_key(w)
+    if not vhdl_index.get_loaded_index(proj):
+        proj = None
+    return lookup_submodules(view, proj, name)
+
+# Return the file of the architecture of an entity and its list of instances (label, type)
+# from the design graph of the project index, or from the Sublime symbol index for an
+# entity outside of the project (or a window without folder). (None,None) if not found.
+def lookup_submodules(view, proj, name):
+    if proj:
+        fname,inst_l = vhdl_index.get_submodules(proj, name)
+        if fname:
+            return fname,inst_l
+    ti = vhdl_module.lookup_type(view,name,2)
+    if ti and ti.get('type','').lower() == 'architecture' and 'fname' in ti:
+        fname = sublime_util.normalize_fname(ti['fname'][0])
+        return fname, vhdl_util.get_inst_list_from_file(fname,name)
+    return None,None
+
+# Check if an entity/component is declared in the project or in the Sublime symbol index
+def lookup_declared(view, proj, name):
+    return vhdl_index.is_declared(proj,name) or bool(view.window().lookup_symbol_in_index(name))
+
+# Return the file and line declaring an entity (or a component) in the project index ((None,0) if unknown
+# or if the index is not in memory, the caller then falls back on the Sublime symbol index)
+def navbar_get_decl_file(w, name):
+    proj = vhdl_index.window_key(w)
+    if vhdl_index.get_loaded_index(proj):
+        return vhdl_index.find_decl(proj, name)
+    return None,0
+
+# Open a file and move to the first occurence of a name
+def goto_in_file(w, fname, name):
+    v = w.find_open_file(fname)
+    if not v:
+        v = w.open_file(fname)
+    if v.is_loading():
+        global callbacks_on_load
+        callbacks_on_load[v.file_name()] = lambda v=v, name=name: goto_first_occurence(v,name)
+    else:
+        goto_first_occurence(v,name)
+
+# Insert text at the beginning of a row of the navbar
+# Optionnaly erase some lines first
+class VhdlNavbarInsertCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit, row, txt, erase=0):
+        v = self.view
+        if erase:
+            end = v.text_point(row+erase,0) if row+erase <= v.rowcol(v.size())[0] else v.size()
+            v.erase(edit, sublime.Region(v.text_point(row,0), end))
+        pos = v.text_point(row,0)
+        # Inserting after the last line: add the missing line return
+        if row > v.rowcol(v.size())[0]:
+            pos = v.size()
+            txt = '\n' + txt.rstrip('\n')
+        v.insert(edit, pos, txt)
+
+# Replace the content of the navbar by applying only the difference between the
+# current and the new content: folds and phantoms of unchanged lines are preserved
+class VhdlNavbarReplaceCommand(sublime_plugin.TextCommand):
+
+    def run(self, edit, txt, fold=False):
+        v = self.view
+        old_lines = v.substr(sublime.Region(0, v.size())).splitlines(True)
+        new_lines = txt.splitlines(True)
+        # Offset of the start of each line of the current content
+        offsets = [0]
+        for l in old_lines:
+            offsets.append(offsets[-1]+len(l))
+        opcodes = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes()
+        inserted = []
+        # Apply modification from the end to keep offsets valid
+        for tag,i1,i2,j1,j2 in reversed(opcodes):
+            if tag == 'equal':
+                continue
+            r = sublime.Region(offsets[i1], offsets[i2])
+            s = ''.join(new_lines[j1:j2])
+            if tag == 'delete':
+                v.erase(edit, r)
+            elif tag == 'insert':
+                v.insert(edit, r.a, s)
+            else:
+                v.replace(edit, r, s)
+            if j2 > j1:
+                inserted.append((j1,j2))
+        if fold:
+            self.fold_new_lines(inserted)
+
+    # Fold functions arguments in new lines (like a fold by level 2)
+    def fold_new_lines(self, inserted):
+        v = self.view
+        folds = []
+        for j1,j2 in inserted:
+            r = None
+            for row in range(j1,j2):
+                l = v.line(v.text_point(row,0))
+                if v.indentation_level(l.a) >= 2 and row > 0:
+                    if r is None:
+                        r = sublime.Region(v.line(v.text_point(row-1,0)).b, l.b)
+                    else:
+                        r.b = l.b
+                elif r is not None:
+                    folds.append(r)
+                    r = None
+            if r is not None:
+                folds.append(r)
+        if folds:
+            v.fold(folds)
+
 # Toggle Open/close navigation Bar
 class VhdlToggleNavbarCommand(sublime_plugin.WindowCommand):
 
@@ -1032,6 +1422,9 @@ class VhdlUpdateNavbarCommand(sublime_plugin.EventListener):
         # print('[VHDL] : fnamer={} - {} ({}), update={}, scope={}, navbar_flag={}'.format(navBar[wid]['info']['fname'],view.file_name(),view.id(),navBar[wid]['settings']['update'],scope,w.settings().get('navbar-hdl-shared', 0)))
         if navBar[wid]['info']['fname'] == view.file_name():
             if 'vhdl' in navBar[wid]['view'].scope_name(0):
+                # Refresh only if the file was modified since the navbar was displayed
+                if 'source.vhdl' in scope:
+                    view.run_command("vhdl_show_navbar")
                 return
             elif 'source.vhdl' in scope:
                 view.run_command("vhdl_show_navbar")
@@ -1084,69 +1477,48 @@ class VhdlHandleNavbarCommand(sublime_plugin.ViewEventListener):
         if not double_click:
             return
         s = self.view.sel()[0]
-        scope = self.view.scope_name(s.a)
         region = self.view.word(s)
         name = self.view.substr(region)
         if name.startswith(u'\u180E'):
             name = name[1:]
         w = sublime.active_window()
         wid = w.id()
-        v = navBar[wid]['info']['view']
+        if wid not in navBar:
+            return
+        nb = navBar[wid]
+        v = nb['info']['view']
+        row,_ = self.view.rowcol(s.a)
+        if row >= len(nb.get('rows',[])):
+            return
+        node = nb['rows'][row]
         debug = v.settings().get("vhdl.debug", False)
-        if debug: print('[NavBar: DoubleClick] s = {}, r={} scope="{}"'.format(s,region,scope))
-        if 'userdefined' in scope:
-            ti = vhdl_module.lookup_type(self.view,name,2)
-            if ti and 'fname' in ti and ti['fname'] :
-                fname = '{}:{}:{}'.format(ti['fname'][0],ti['fname'][1],ti['fname'][2])
-                w.focus_view(v)
-                w.open_file(fname,sublime.ENCODED_POSITION)
-        elif 'entity.name.method' in scope:
-            cname = navbar_get_class(self.view,s)
-            if cname :
-                filelist = w.lookup_symbol_in_index(cname)
-                if debug: print('[NavBar: DoubleClick] Class {} -> filelist = {}'.format(cname, filelist))
-                if filelist :
-                    sublime_util.goto_symbol_in_file(v,name,sublime_util.normalize_fname(filelist[0][0]))
-            else :
-                # sublime_util.goto_symbol_in_file(v,name,v.file_name())
-                # sublime.set_timeout(lambda w=w, name=name, debug=debug: move_to_def(w.active_view(),name,debug))
-                if debug: print('[NavBar: DoubleClick] MoveToDef of {}'.format(name))
-                move_to_def(v,name,debug)
-        else:
-            cname = navbar_get_class(self.view,s)
-            if cname :
-                # print('[VHDL.Navbar] Class for {} is {}'.format(name,cname))
-                if cname in ['function','task']:
-                    return
-                v,fname = sublime_util.goto_index_symbol(v,cname)
-                if v:
-                    # print('GotoIndexSymbols -> {} ({})'.format(fname,v.id()))
-                    if fname:
-                        global callbacks_on_load
-                        callbacks_on_load[fname] = lambda v=v, name=name: goto_first_occurence(v,name)
-                        return
-                    else :
-                        goto_first_occurence(v,name)
+        if debug: print('[NavBar: DoubleClick] s = {}, r={} node={} {}'.format(s,region,node.kind,node.name))
+        if node.kind == 'inst':
+            # Type of the instance: go to the entity declaration
+            if name == node.type:
+                fname,line = navbar_get_decl_file(w,name)
+                if fname:
+                    w.focus_view(v)
+                    w.open_file('{}:{}:1'.format(fname,line),sublime.ENCODED_POSITION)
+                else:
+                    ti = vhdl_module.lookup_type(v,name,2)
+                    if ti and 'fname' in ti and ti['fname'] :
+                        fname = '{}:{}:{}'.format(ti['fname'][0],ti['fname'][1],ti['fname'][2])
+                        w.focus_view(v)
+                        w.open_file(fname,sublime.ENCODED_POSITION)
+            # Instance inside a sub-module: go to the instance in the architecture of the parent
+            elif node.parent and node.parent.kind == 'inst' and node.parent.fname:
+                goto_in_file(w,node.parent.fname,node.name)
             else :
-                # print('[VHDL.Navbar] Navigate to first occurence of {}'.format(name))
-                goto_first_occurence(v,name)
-
-def navbar_get_class(view,r):
-    il = view.indentation_level(r.a)
-    # Not local member : find to which class this belongs
-    if il > 1 :
-        r = view.indented_region(r.a)
-        p = view.find_by_class(r.a,False,sublime.CLASS_WORD_START)
-        # If going up one level gives a keyword, it means we need to go up another level
-        scope = view.scope_name(p)
-        if 'keyword' in scope:
-            r = view.indented_region(p)
-            p = view.find_by_class(r.a,False,sublime.CLASS_WORD_START)
-        cname = view.substr(view.word(p))
-    else :
-        cname = ''
-    return cname
-
+                goto_first_occurence(v,node.name)
+        elif node.kind in ['func','proc']:
+            if debug: print('[NavBar: DoubleClick] MoveToDef of {}'.format(node.name))
+            move_to_def(v,node.name,debug)
+        elif node.kind == 'arg':
+            move_to_def(v,node.parent.name,debug)
+        elif node.kind in ['port','const','signal','alias','process']:
+            # print('[VHDL.Navbar] Navigate to first occurence of {}'.format(name))
+            goto_first_occurence(v,name)
 
 def goto_first_occurence(view,name):
     r = sublime.Region(0)